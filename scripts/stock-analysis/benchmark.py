@@ -0,0 +1,553 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for the stock analysis pipeline
+
+Replays Finviz/Yahoo/Wikipedia HTML, yfinance data and a stub Supabase
+client so each stage can be timed without touching live services:
+    
+    python benchmark.py                      # 10, 100 and 1000 tickers
+    python benchmark.py --sizes 100 --output bench.json
+    python benchmark.py --compare bench.json # show ratios against a baseline
+    python benchmark.py --record fixtures/   # capture live pages for replay
+    python benchmark.py --fixtures fixtures/ # replay recorded pages
+
+With --fixtures the universe starts with the recorded tickers and is
+padded to each size with deterministic synthetic ones (which also stand in
+for anything not recorded).
+Rate-limiter waits are skipped, so the numbers measure our own work.
+"""
+
+import argparse
+import atexit
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+from datetime import datetime, timedelta
+from pathlib import Path
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+if script_dir not in sys.path:
+    sys.path.insert(0, script_dir)
+
+# config refuses to import without credentials; the stub never uses them.
+# Caches go to a throwaway directory so runs start cold and leave no trace.
+os.environ.setdefault('NEXT_PUBLIC_SUPABASE_URL', 'http://localhost:54321')
+os.environ.setdefault('NEXT_PUBLIC_SUPABASE_ANON_KEY', 'benchmark')
+if 'CACHE_DIR' not in os.environ:
+    os.environ['CACHE_DIR'] = tempfile.mkdtemp(prefix='stock-bench-')
+    atexit.register(shutil.rmtree, os.environ['CACHE_DIR'], ignore_errors=True)
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+import rate_limit
+import webscrape
+from cache import HeadlineScoreCache, NewsStore
+from config import CACHE_DIR, FALLBACK_TICKERS
+from database import DatabaseManager
+from generate_data import attach_prediction, rank_stocks_by_investment_potential
+from predict import predict_stock_trend, predict_stock_trends, make_rng
+from sentiment_analysis import SentimentAnalyzer
+
+
+DEFAULT_SIZES = (10, 100, 1000)
+HISTORY_DAYS = 90
+
+WORDS = (
+    'beats estimates', 'misses expectations', 'raises guidance', 'cuts outlook', 'announces buyback',
+    'faces lawsuit', 'upgraded to buy', 'downgraded to sell', 'record revenue', 'layoffs announced',
+    'strong demand', 'weak quarter', 'surges after earnings', 'plunges on probe', 'dividend hike',
+    'new product launch', 'CEO steps down', 'partnership expands', 'regulatory approval', 'supply concerns',
+)
+
+
+def _seed(text):
+    return zlib.crc32(text.encode())
+
+
+def synthetic_tickers(count):
+    """Deterministic 3-5 letter tickers: AAA, AAB, ..."""
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    tickers = []
+    for i in range(count):
+        code, n = '', i + 26 * 26
+        while n:
+            n, r = divmod(n, 26)
+            code = letters[r] + code
+        tickers.append(code)
+    return tickers
+
+
+def synthetic_headlines(ticker, count, rng):
+    subjects = (ticker, f'{ticker} Inc', f'Shares of {ticker}', f'{ticker} stock')
+    return [
+        f"{subjects[rng.integers(len(subjects))]} {WORDS[rng.integers(len(WORDS))]} "
+        f"{WORDS[rng.integers(len(WORDS))]} in week {rng.integers(1, 53)}"
+        for _ in range(count)
+    ]
+
+
+class Fixtures:
+    """Recorded responses from a fixtures directory, with synthetic fallbacks.
+    
+    Layout: finviz/<T>.html, yahoo/<T>.html (quote page), yahoo_news/<T>.json,
+    prices/<T>.parquet, info/<T>.json and wikipedia/<page>.html.
+    """
+    
+    def __init__(self, root=None, now=None):
+        self.root = Path(root) if root else None
+        self.now = now or datetime.now()
+        self.universe = []
+    
+    def _recorded(self, *parts):
+        if self.root is None:
+            return None
+        path = self.root.joinpath(*parts)
+        return path if path.exists() else None
+    
+    def recorded_tickers(self):
+        """Tickers with recorded prices (the last thing --record writes), sorted"""
+        if self.root is None or not (self.root / 'prices').is_dir():
+            return []
+        return sorted(path.stem for path in (self.root / 'prices').glob('*.parquet'))
+    
+    def tickers(self, count):
+        """count tickers: the recorded ones first, padded with synthetic ones"""
+        tickers = self.recorded_tickers()[:count]
+        recorded = set(tickers)
+        extra = (ticker for ticker in synthetic_tickers(count + len(recorded)) if ticker not in recorded)
+        return tickers + [next(extra) for _ in range(count - len(tickers))]
+    
+    def finviz_html(self, ticker):
+        path = self._recorded('finviz', f'{ticker}.html')
+        if path:
+            return path.read_text()
+        
+        rng = np.random.default_rng(_seed('finviz' + ticker))
+        rows = []
+        day = self.now
+        for i, headline in enumerate(synthetic_headlines(ticker, 60, rng)):
+            if i % 4 == 0:
+                day -= timedelta(days=int(rng.integers(0, 3)))
+                stamp = f"{day.strftime('%b-%d-%y')} 09:{i % 60:02d}AM"
+            else:
+                stamp = f"10:{i % 60:02d}AM"
+            rows.append(
+                f'<tr><td align="right" width="130">{stamp}</td><td><div class="news-link-container">'
+                f'<div class="news-link-left"><a class="tab-link-news" href="https://example.com/{ticker}/{i}">'
+                f'{headline}</a></div><div class="news-link-right"><span>(Newswire)</span></div></div></td></tr>'
+            )
+        return (
+            f'<html><head><title>{ticker} Stock Quote</title></head><body>'
+            f'<table id="news-table" class="fullview-news-outer">{"".join(rows)}</table></body></html>'
+        )
+    
+    def yahoo_html(self, ticker):
+        path = self._recorded('yahoo', f'{ticker}.html')
+        if path:
+            return path.read_text()
+        return '<html><head><title>Yahoo</title></head><body></body></html>'
+    
+    def yahoo_news(self, ticker):
+        path = self._recorded('yahoo_news', f'{ticker}.json')
+        if path:
+            return json.loads(path.read_text())
+        rng = np.random.default_rng(_seed('yahoo' + ticker))
+        return [{'title': headline, 'publisher': 'Newswire'} for headline in synthetic_headlines(ticker, 10, rng)]
+    
+    def info(self, ticker):
+        path = self._recorded('info', f'{ticker}.json')
+        if path:
+            return json.loads(path.read_text())
+        rng = np.random.default_rng(_seed('info' + ticker))
+        return {
+            'marketCap': int(rng.integers(1, 3000)) * 10 ** 9,
+            'shortName': f'{ticker} Holdings',
+            'sector': ('Technology', 'Healthcare', 'Financials', 'Energy')[int(rng.integers(4))],
+        }
+    
+    def prices(self, ticker, start=None, end=None):
+        path = self._recorded('prices', f'{ticker}.parquet')
+        if path:
+            hist = pd.read_parquet(path)
+        else:
+            rng = np.random.default_rng(_seed('prices' + ticker))
+            index = pd.bdate_range(end=pd.Timestamp(self.now).normalize(), periods=HISTORY_DAYS * 5 // 7)
+            close = 20 + rng.random() * 400
+            close = close * np.exp(np.cumsum(rng.normal(0.0005, 0.015, len(index))))
+            hist = pd.DataFrame({
+                'Open': close * (1 + rng.normal(0, 0.003, len(index))),
+                'High': close * 1.01,
+                'Low': close * 0.99,
+                'Close': close,
+                'Volume': rng.integers(10 ** 5, 10 ** 7, len(index)).astype(float),
+            }, index=index)
+        
+        if start is not None:
+            hist = hist[hist.index >= pd.Timestamp(start).normalize()]
+        if end is not None:
+            hist = hist[hist.index <= pd.Timestamp(end)]
+        return hist
+    
+    def wikipedia_html(self, url):
+        page = url.rsplit('/', 1)[-1]
+        path = self._recorded('wikipedia', f'{page}.html')
+        if path:
+            return path.read_text()
+        
+        # The universe goes in the S&P 500 page; the other indexes add nothing new
+        tickers = self.universe if 'S%26P_500' in url else self.universe[:30]
+        rows = ''.join(f'<tr><td>{t}</td><td>{t} Holdings</td></tr>' for t in tickers)
+        return f'<html><body><table><tr><th>Symbol</th><th>Security</th></tr>{rows}</table></body></html>'
+
+
+class _ReplayTicker:
+    def __init__(self, fixtures, ticker):
+        self.fixtures = fixtures
+        self.ticker = ticker
+    
+    @property
+    def info(self):
+        return self.fixtures.info(self.ticker)
+    
+    @property
+    def news(self):
+        return self.fixtures.yahoo_news(self.ticker)
+    
+    def history(self, start=None, end=None, **kwargs):
+        return self.fixtures.prices(self.ticker, start, end)
+
+
+def install_replay(fixtures):
+    """Route every network call the pipeline makes to fixtures"""
+    def fetch_text(url, host, headers=None, timeout=15, revalidate=False):
+        if host == 'finviz':
+            return fixtures.finviz_html(url.rsplit('=', 1)[-1])
+        if host == 'wikipedia':
+            return fixtures.wikipedia_html(url)
+        return fixtures.yahoo_html(url.rstrip('/').rsplit('/', 1)[-1])
+    
+    def download(tickers, start=None, end=None, **kwargs):
+        frames = {ticker: fixtures.prices(ticker, start, end) for ticker in tickers}
+        return pd.concat(frames, axis=1)
+    
+    webscrape.fetch_text = fetch_text
+    rate_limit.acquire = lambda host: 0.0
+    yf.Ticker = lambda ticker: _ReplayTicker(fixtures, ticker)
+    yf.download = download
+
+
+class StubSupabase:
+    """In-memory stand-in for the PostgREST client used by DatabaseManager.
+    
+    Supports the query-builder subset the writers use. latency_ms is added
+    to every request to approximate a network round trip.
+    """
+    
+    def __init__(self, latency_ms=0.0):
+        self.latency = latency_ms / 1000.0
+        self.tables = {}
+        self.requests = 0
+    
+    def table(self, name):
+        return _StubQuery(self, name)
+
+
+class _StubQuery:
+    def __init__(self, stub, table):
+        self.stub = stub
+        self.table_name = table
+        self.op = 'select'
+        self.payload = None
+        self.on_conflict = ''
+        self.filters = []
+        self.window = None
+        self.count = None
+        self.head = False
+    
+    def select(self, *columns, count=None, head=False):
+        self.op, self.count, self.head = 'select', count, head
+        return self
+    
+    def insert(self, json, returning=None, **kwargs):
+        self.op, self.payload = 'insert', json
+        return self
+    
+    def upsert(self, json, on_conflict='', returning=None, **kwargs):
+        self.op, self.payload, self.on_conflict = 'upsert', json, on_conflict
+        return self
+    
+    def delete(self, returning=None, **kwargs):
+        self.op = 'delete'
+        return self
+    
+    def eq(self, column, value):
+        self.filters.append((column, lambda v: v == value, {value}))
+        return self
+    
+    def in_(self, column, values):
+        values = set(values)
+        self.filters.append((column, lambda v: v in values, values))
+        return self
+    
+    def lt(self, column, value):
+        self.filters.append((column, lambda v: v < value, None))
+        return self
+    
+    def order(self, *args, **kwargs):
+        return self
+    
+    def range(self, start, end):
+        self.window = (start, end)
+        return self
+    
+    def _tickers(self, rows_by_ticker):
+        for column, _, values in self.filters:
+            if column == 'ticker' and values is not None:
+                return [ticker for ticker in values if ticker in rows_by_ticker]
+        return list(rows_by_ticker)
+    
+    def _matches(self, row):
+        return all(test(row.get(column)) for column, test, _ in self.filters)
+    
+    def execute(self):
+        self.stub.requests += 1
+        if self.stub.latency:
+            time.sleep(self.stub.latency)
+        
+        rows_by_ticker = self.stub.tables.setdefault(self.table_name, {})
+        
+        if self.op == 'select':
+            rows = [row for ticker in sorted(self._tickers(rows_by_ticker))
+                    for row in rows_by_ticker[ticker] if self._matches(row)]
+            total = len(rows)
+            if self.window:
+                rows = rows[self.window[0]:self.window[1] + 1]
+            return _StubResponse([] if self.head else rows, total if self.count else None)
+        
+        if self.op == 'delete':
+            for ticker in self._tickers(rows_by_ticker):
+                rows_by_ticker[ticker] = [row for row in rows_by_ticker[ticker] if not self._matches(row)]
+            return _StubResponse([])
+        
+        payload = self.payload if isinstance(self.payload, list) else [self.payload]
+        keys = self.on_conflict.split(',') if self.op == 'upsert' else None
+        for row in payload:
+            rows = rows_by_ticker.setdefault(row['ticker'], [])
+            if keys:
+                key = tuple(row[column] for column in keys)
+                rows[:] = [r for r in rows if tuple(r.get(column) for column in keys) != key]
+            rows.append(dict(row))
+        return _StubResponse([])
+
+
+class _StubResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+def _measure(func, items=1, latencies=None):
+    """Run func with output silenced; return timing and peak-memory stats"""
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = func()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - base
+    
+    stats = {
+        'items': items,
+        'seconds': round(seconds, 4),
+        'throughput_per_s': round(items / seconds, 2) if seconds > 0 else None,
+        'peak_mb': round(peak / 2 ** 20, 2),
+    }
+    if latencies:
+        stats['latency_ms_p50'] = round(float(np.percentile(latencies, 50)) * 1000, 3)
+        stats['latency_ms_p95'] = round(float(np.percentile(latencies, 95)) * 1000, 3)
+    return result, stats
+
+
+def _measure_each(func, items):
+    """_measure() over func(item) for every item, adding per-call latency percentiles"""
+    latencies = []
+    
+    def run():
+        results = []
+        for item in items:
+            start = time.perf_counter()
+            results.append(func(item))
+            latencies.append(time.perf_counter() - start)
+        return results
+    
+    return _measure(run, items=len(items), latencies=latencies)
+
+
+def run_size(fixtures, size, db_latency_ms=0.0, write_mode=None):
+    """Benchmark every stage at one universe size; returns {stage: stats}"""
+    tickers = fixtures.tickers(size)
+    fixtures.universe = tickers
+    universe = pd.DataFrame([
+        {
+            'ticker': ticker,
+            'name': info.get('shortName') or f'{ticker} Holdings',
+            'market_cap': info.get('marketCap') or 0,
+            'sector': info.get('sector') or 'Technology',
+        }
+        for ticker, info in ((ticker, fixtures.info(ticker)) for ticker in tickers)
+    ])
+    results = {}
+    
+    _, results['get_top_101_stocks'] = _measure(
+        lambda: webscrape.get_top_101_stocks(force_refresh=True), items=size
+    )
+    
+    size_dir = Path(CACHE_DIR) / f'size-{size}'
+    analyzer = SentimentAnalyzer(score_cache=HeadlineScoreCache(cache_dir=size_dir), news_store=NewsStore(cache_dir=size_dir))
+    rows = [row.to_dict() for _, row in universe.iterrows()]
+    sentiment, results['analyze_ticker_sentiment'] = _measure_each(analyzer.analyze_ticker_sentiment, rows)
+    
+    prices = {ticker: fixtures.prices(ticker) for ticker in tickers}
+    rng = make_rng(0)
+    forecasts, results['predict_stock_trend'] = _measure_each(
+        lambda result: predict_stock_trend(result['ticker'], prices[result['ticker']], result['avg_sentiment'], rng=rng),
+        sentiment
+    )
+    
+    _, results['predict_stock_trends (vectorized)'] = _measure(
+        lambda: predict_stock_trends(
+            [(result['ticker'], prices[result['ticker']], result['avg_sentiment']) for result in sentiment],
+            rng=make_rng(0)
+        ),
+        items=size
+    )
+    
+    for result, forecast in zip(sentiment, forecasts):
+        attach_prediction(result, prices[result['ticker']], forecast)
+    
+    ranked, results['rank_stocks_by_investment_potential'] = _measure(
+        lambda: rank_stocks_by_investment_potential(sentiment), items=size
+    )
+    
+    (Path(CACHE_DIR) / 'db_state.json').unlink(missing_ok=True)
+    stub = StubSupabase(latency_ms=db_latency_ms)
+    db = DatabaseManager(client=stub)
+    for label in ('write_analysis_to_database', 'write_analysis_to_database (repeat)'):
+        stub.requests = 0
+        _, stats = _measure(lambda: db.write_analysis_to_database(ranked, {}, mode=write_mode), items=size)
+        stats['requests'] = stub.requests
+        results[label] = stats
+    db.close()
+    
+    return results
+
+
+def print_results(report, baseline=None):
+    columns = ('seconds', 'throughput_per_s', 'latency_ms_p50', 'latency_ms_p95', 'peak_mb')
+    for size, stages in report['sizes'].items():
+        print(f"\n{size} tickers")
+        print(f"  {'stage':<40}" + ''.join(f'{column:>18}' for column in columns))
+        for stage, stats in stages.items():
+            line = f"  {stage:<40}"
+            for column in columns:
+                value = stats.get(column)
+                cell = '-' if value is None else f'{value:g}'
+                old = (baseline or {}).get('sizes', {}).get(size, {}).get(stage, {}).get(column)
+                if old and value is not None:
+                    cell += f' ({value / old:.2f}x)'
+                line += f'{cell:>18}'
+            print(line)
+
+
+def record_fixtures(root, tickers):
+    """Capture live responses for tickers into root for later --fixtures replay"""
+    from http_session import fetch_text
+    
+    root = Path(root)
+    for folder in ('finviz', 'yahoo', 'yahoo_news', 'prices', 'info', 'wikipedia'):
+        (root / folder).mkdir(parents=True, exist_ok=True)
+    
+    for url in ("https://en.wikipedia.org/wiki/List_of_S%26P_500_companies",
+                "https://en.wikipedia.org/wiki/Nasdaq-100",
+                "https://en.wikipedia.org/wiki/Dow_Jones_Industrial_Average"):
+        (root / 'wikipedia' / f"{url.rsplit('/', 1)[-1]}.html").write_text(fetch_text(url, 'wikipedia'))
+    
+    end = datetime.now()
+    start = end - timedelta(days=HISTORY_DAYS)
+    for ticker in tickers:
+        try:
+            (root / 'finviz' / f'{ticker}.html').write_text(
+                fetch_text(f'https://finviz.com/quote.ashx?t={ticker}', 'finviz',
+                           headers={'User-Agent': webscrape.get_random_user_agent()})
+            )
+            (root / 'yahoo' / f'{ticker}.html').write_text(
+                fetch_text(f'https://finance.yahoo.com/quote/{ticker}', 'yahoo',
+                           headers={'User-Agent': webscrape.get_random_user_agent()})
+            )
+            rate_limit.acquire('yfinance')
+            stock = yf.Ticker(ticker)
+            (root / 'yahoo_news' / f'{ticker}.json').write_text(json.dumps(stock.news or [], default=str))
+            rate_limit.acquire('yfinance')
+            info = stock.info
+            (root / 'info' / f'{ticker}.json').write_text(json.dumps(
+                {key: info.get(key) for key in ('marketCap', 'shortName', 'longName', 'sector')}
+            ))
+            rate_limit.acquire('yfinance')
+            stock.history(start=start, end=end).to_parquet(root / 'prices' / f'{ticker}.parquet')
+            print(f"✓ Recorded {ticker}")
+        except Exception as e:
+            print(f"✗ Could not record {ticker}: {e}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark pipeline stages offline")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES))
+    parser.add_argument('--fixtures', help="directory of recorded fixtures to replay")
+    parser.add_argument('--record', help="record live fixtures into this directory and exit")
+    parser.add_argument('--output', help="write results as JSON to this path")
+    parser.add_argument('--compare', help="baseline JSON from an earlier --output run")
+    parser.add_argument('--db-latency-ms', type=float, default=0.0, help="simulated Supabase round trip")
+    parser.add_argument('--write-mode', help="DB_WRITE_MODE to benchmark (default from config)")
+    args = parser.parse_args(argv)
+    
+    if args.record:
+        record_fixtures(args.record, FALLBACK_TICKERS[:10])
+        return
+    
+    fixtures = Fixtures(args.fixtures)
+    install_replay(fixtures)
+    tracemalloc.start()
+    
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(),
+            'python': sys.version.split()[0],
+            'fixtures': args.fixtures or 'synthetic',
+            'db_latency_ms': args.db_latency_ms,
+            'write_mode': args.write_mode,
+        },
+        'sizes': {},
+    }
+    for size in args.sizes:
+        print(f"Benchmarking {size} tickers...")
+        report['sizes'][str(size)] = run_size(fixtures, size, args.db_latency_ms, args.write_mode)
+    
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+    print_results(report, baseline)
+    
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
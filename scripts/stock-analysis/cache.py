@@ -0,0 +1,597 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+import pandas as pd
+from config import (
+    CACHE_DIR, PRICE_CACHE_TTL_MINUTES, PRICE_CACHE_FULL_REFRESH_DAYS,
+    PRICE_CACHE_RETENTION_DAYS, PRICE_CACHE_EVICT_DAYS, UNIVERSE_TTL_HOURS,
+    HEADLINE_CACHE_DAYS, NEWS_STORE_DAYS, CHECKPOINT_TTL_HOURS
+)
+from results import PriceSeries
+
+
+class PriceCache:
+    """On-disk Parquet store of daily price bars, one file per ticker.
+    
+    A manifest records when each ticker was last refreshed, last fully
+    re-downloaded and last read, which drives the staleness and eviction rules.
+    """
+    
+    def __init__(self, cache_dir=None):
+        self.root = Path(cache_dir or CACHE_DIR) / 'prices'
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.root / 'manifest.json'
+        self.lock = threading.Lock()
+        self.manifest = self._load_manifest()
+    
+    def _load_manifest(self):
+        """Load the manifest, starting empty if it is missing or unreadable"""
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def _path(self, ticker):
+        return self.root / f"{ticker}.parquet"
+    
+    def load(self, ticker, start_date=None):
+        """Return cached bars for ticker (optionally from start_date on), or None"""
+        path = self._path(ticker)
+        if not path.exists():
+            return None
+        
+        try:
+            hist = pd.read_parquet(path)
+        except Exception as e:
+            print(f"    ⚠ Discarding unreadable price cache for {ticker}: {e}")
+            path.unlink(missing_ok=True)
+            return None
+        
+        with self.lock:
+            self.manifest.setdefault(ticker, {})['last_used'] = datetime.now().isoformat()
+        
+        if start_date is not None:
+            hist = hist[hist.index >= pd.Timestamp(start_date).normalize()]
+        
+        return hist if not hist.empty else None
+    
+    def fetch_start(self, ticker, start_date, now=None):
+        """Decide what to download for ticker.
+        
+        Returns None when the cache is fresh enough to use as-is, start_date
+        when the whole window must be downloaded, or the last cached date when
+        only newer bars are needed. The last cached bar is re-fetched because
+        it may have been written mid-session.
+        """
+        now = now or datetime.now()
+        entry = self.manifest.get(ticker)
+        path = self._path(ticker)
+        
+        if not entry or 'fetched_at' not in entry or not path.exists():
+            return start_date
+        
+        full_fetched_at = datetime.fromisoformat(entry.get('full_fetched_at', entry['fetched_at']))
+        if now - full_fetched_at > timedelta(days=PRICE_CACHE_FULL_REFRESH_DAYS):
+            return start_date
+        
+        # Cache does not reach back far enough (e.g. a longer window was requested)
+        first_date = pd.Timestamp(entry['first_date'])
+        if first_date > pd.Timestamp(start_date).normalize() + pd.Timedelta(days=5):
+            return start_date
+        
+        if now - datetime.fromisoformat(entry['fetched_at']) < timedelta(minutes=PRICE_CACHE_TTL_MINUTES):
+            return None
+        
+        return pd.Timestamp(entry['last_date']).to_pydatetime()
+    
+    def merge(self, ticker, new_bars, full, now=None):
+        """Merge freshly downloaded bars into the cache and return the stored frame.
+        
+        fetched_at/last_date only move forward when new bars arrived.
+        """
+        now = now or datetime.now()
+        
+        if new_bars is not None and 'Close' not in new_bars.columns:
+            new_bars = None
+        
+        if new_bars is not None and not new_bars.empty:
+            new_bars = new_bars.dropna(subset=['Close'])
+            new_bars.index = pd.DatetimeIndex(new_bars.index).tz_localize(None).normalize()
+        
+        # Nothing downloaded (failed or empty): leave the cache and its
+        # timestamps alone, so the ticker stays due for a refresh
+        if new_bars is None or new_bars.empty:
+            return None if full else self.load(ticker)
+        
+        existing = None if full else self.load(ticker)
+        
+        if existing is not None:
+            hist = pd.concat([existing[existing.index < new_bars.index.min()], new_bars])
+        else:
+            hist = new_bars
+        
+        hist = hist[~hist.index.duplicated(keep='last')].sort_index()
+        hist = hist[hist.index >= pd.Timestamp(now - timedelta(days=PRICE_CACHE_RETENTION_DAYS)).normalize()]
+        if hist.empty:
+            return None
+        hist.to_parquet(self._path(ticker))
+        
+        with self.lock:
+            entry = self.manifest.setdefault(ticker, {})
+            entry['fetched_at'] = now.isoformat()
+            entry['last_used'] = now.isoformat()
+            if full or 'full_fetched_at' not in entry:
+                entry['full_fetched_at'] = now.isoformat()
+            entry['first_date'] = hist.index[0].strftime('%Y-%m-%d')
+            entry['last_date'] = hist.index[-1].strftime('%Y-%m-%d')
+        
+        return hist
+    
+    def evict(self, now=None):
+        """Delete tickers that have not been read for PRICE_CACHE_EVICT_DAYS"""
+        now = now or datetime.now()
+        cutoff = now - timedelta(days=PRICE_CACHE_EVICT_DAYS)
+        
+        with self.lock:
+            stale = [
+                ticker for ticker, entry in self.manifest.items()
+                if datetime.fromisoformat(entry.get('last_used', entry.get('fetched_at', now.isoformat()))) < cutoff
+            ]
+            for ticker in stale:
+                self._path(ticker).unlink(missing_ok=True)
+                del self.manifest[ticker]
+        
+        return stale
+    
+    def save(self):
+        """Persist the manifest atomically"""
+        with self.lock:
+            tmp_path = self.manifest_path.with_suffix('.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(self.manifest, f, indent=2, sort_keys=True)
+            tmp_path.replace(self.manifest_path)
+
+
+_price_cache = None
+_price_cache_lock = threading.Lock()
+
+
+def get_price_cache():
+    """Return the process-wide PriceCache"""
+    global _price_cache
+    with _price_cache_lock:
+        if _price_cache is None:
+            _price_cache = PriceCache()
+        return _price_cache
+
+
+def load_universe_snapshot(max_age_hours=None, cache_dir=None):
+    """Return the saved universe (sorted by market cap) if it is fresh, else None"""
+    if max_age_hours is None:
+        max_age_hours = UNIVERSE_TTL_HOURS
+    if max_age_hours <= 0:
+        return None
+    
+    path = Path(cache_dir or CACHE_DIR) / 'universe.json'
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+        built_at = datetime.fromisoformat(snapshot['built_at'])
+    except (OSError, ValueError, KeyError):
+        return None
+    
+    if datetime.now() - built_at > timedelta(hours=max_age_hours):
+        return None
+    
+    stocks_df = pd.DataFrame(snapshot['stocks'], columns=['ticker', 'name', 'market_cap', 'sector'])
+    if stocks_df.empty:
+        return None
+    
+    stocks_df.attrs['built_at'] = built_at
+    return stocks_df
+
+
+def save_universe_snapshot(stocks_df, cache_dir=None):
+    """Persist the market-cap sorted universe for later runs"""
+    root = Path(cache_dir or CACHE_DIR)
+    root.mkdir(parents=True, exist_ok=True)
+    path = root / 'universe.json'
+    
+    snapshot = {
+        'built_at': datetime.now().isoformat(),
+        'stocks': stocks_df[['ticker', 'name', 'market_cap', 'sector']].to_dict('records')
+    }
+    
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(snapshot, f, default=str)
+    tmp_path.replace(path)
+
+
+class HeadlineScoreCache:
+    """SQLite map from headline content hash to its VADER compound score.
+    
+    Shared by worker threads; entries not seen for HEADLINE_CACHE_DAYS are
+    pruned when the cache is opened.
+    """
+    
+    def __init__(self, cache_dir=None):
+        root = Path(cache_dir or CACHE_DIR)
+        root.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(root / 'headline_scores.sqlite', check_same_thread=False)
+        
+        with self.lock, self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS scores ('
+                'hash TEXT PRIMARY KEY, compound REAL NOT NULL, seen_at TEXT NOT NULL)'
+            )
+            cutoff = (datetime.now() - timedelta(days=HEADLINE_CACHE_DAYS)).isoformat()
+            self.conn.execute('DELETE FROM scores WHERE seen_at < ?', (cutoff,))
+    
+    def get_many(self, keys):
+        """Return {key: compound} for the keys already scored"""
+        found = {}
+        keys = list(keys)
+        now = datetime.now().isoformat()
+        
+        with self.lock, self.conn:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self.conn.execute(
+                    f'SELECT hash, compound FROM scores WHERE hash IN ({placeholders})', chunk
+                ).fetchall()
+                found.update(rows)
+                self.conn.execute(
+                    f'UPDATE scores SET seen_at = ? WHERE hash IN ({placeholders})', [now] + chunk
+                )
+        
+        return found
+    
+    def put_many(self, scores):
+        """Store {key: compound} pairs"""
+        now = datetime.now().isoformat()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO scores (hash, compound, seen_at) VALUES (?, ?, ?)',
+                [(key, float(compound), now) for key, compound in scores.items()]
+            )
+
+
+def headline_hash(headline):
+    """Content key for a headline, independent of how it is scored"""
+    return hashlib.sha1(headline.encode()).hexdigest()
+
+
+class NewsStore:
+    """Append-only SQLite store of scored headlines per ticker, with daily aggregates.
+    
+    Headlines are keyed by (ticker, headline hash), so a headline is counted
+    once however many runs or sources return it; it keeps the date it was
+    first published under. Each new headline is added to its day's running
+    totals, so sentiment over a window is a sum over at most DAYS_BACK rows.
+    Headlines and totals older than NEWS_STORE_DAYS are pruned on open.
+    
+    Scores depend on the lexicon, so the store records the lexicon key they
+    were made with; see needs_rescore() and rescore().
+    """
+    
+    def __init__(self, cache_dir=None):
+        root = Path(cache_dir or CACHE_DIR)
+        root.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(root / 'news.sqlite', check_same_thread=False)
+        
+        with self.lock, self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS headlines ('
+                'ticker TEXT NOT NULL, hash TEXT NOT NULL, day TEXT NOT NULL, published_at TEXT NOT NULL, '
+                'headline TEXT NOT NULL, source TEXT, compound REAL NOT NULL, category TEXT NOT NULL, '
+                'first_seen TEXT NOT NULL, PRIMARY KEY (ticker, hash))'
+            )
+            self.conn.execute('CREATE INDEX IF NOT EXISTS headlines_by_day ON headlines (ticker, day)')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS daily ('
+                'ticker TEXT NOT NULL, day TEXT NOT NULL, news_count INTEGER NOT NULL, '
+                'compound_sum REAL NOT NULL, bullish INTEGER NOT NULL, neutral INTEGER NOT NULL, '
+                'bearish INTEGER NOT NULL, PRIMARY KEY (ticker, day))'
+            )
+            self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            
+            cutoff = (datetime.now() - timedelta(days=NEWS_STORE_DAYS)).date().isoformat()
+            self.conn.execute('DELETE FROM headlines WHERE day < ?', (cutoff,))
+            self.conn.execute('DELETE FROM daily WHERE day < ?', (cutoff,))
+    
+    def known(self, ticker, hashes):
+        """Return the subset of headline hashes already stored for ticker"""
+        hashes = list(hashes)
+        found = set()
+        
+        with self.lock:
+            for i in range(0, len(hashes), 500):
+                chunk = hashes[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self.conn.execute(
+                    f'SELECT hash FROM headlines WHERE ticker = ? AND hash IN ({placeholders})',
+                    [ticker] + chunk
+                ).fetchall()
+                found.update(row[0] for row in rows)
+        
+        return found
+    
+    def add(self, ticker, news_df):
+        """Store unseen headlines and fold them into the daily totals.
+        
+        news_df needs hash, parsed_date, headline, source, compound and
+        category columns. Returns the number of headlines added.
+        """
+        now = datetime.now().isoformat()
+        cutoff = (datetime.now() - timedelta(days=NEWS_STORE_DAYS)).date().isoformat()
+        added = 0
+        
+        with self.lock, self.conn:
+            for row in news_df.itertuples(index=False):
+                published_at = pd.Timestamp(row.parsed_date)
+                day = published_at.date().isoformat()
+                if day < cutoff:
+                    continue
+                
+                cursor = self.conn.execute(
+                    'INSERT OR IGNORE INTO headlines '
+                    '(ticker, hash, day, published_at, headline, source, compound, category, first_seen) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (ticker, row.hash, day, published_at.isoformat(), row.headline, row.source,
+                     float(row.compound), row.category, now)
+                )
+                if cursor.rowcount != 1:
+                    continue
+                
+                added += 1
+                self.conn.execute(
+                    'INSERT INTO daily (ticker, day, news_count, compound_sum, bullish, neutral, bearish) '
+                    'VALUES (?, ?, 1, ?, ?, ?, ?) '
+                    'ON CONFLICT (ticker, day) DO UPDATE SET '
+                    'news_count = news_count + 1, compound_sum = compound_sum + excluded.compound_sum, '
+                    'bullish = bullish + excluded.bullish, neutral = neutral + excluded.neutral, '
+                    'bearish = bearish + excluded.bearish',
+                    (ticker, day, float(row.compound), int(row.category == 'Bullish'),
+                     int(row.category == 'Neutral'), int(row.category == 'Bearish'))
+                )
+        
+        return added
+    
+    def window(self, ticker, since=None):
+        """Return aggregate counts and compound sum for ticker's headlines from since (all if None)"""
+        query = (
+            'SELECT COALESCE(SUM(news_count), 0), COALESCE(SUM(compound_sum), 0), COALESCE(SUM(bullish), 0), '
+            'COALESCE(SUM(neutral), 0), COALESCE(SUM(bearish), 0) FROM daily WHERE ticker = ?'
+        )
+        params = [ticker]
+        if since is not None:
+            query += ' AND day >= ?'
+            params.append(pd.Timestamp(since).date().isoformat())
+        
+        with self.lock:
+            news_count, compound_sum, bullish, neutral, bearish = self.conn.execute(query, params).fetchone()
+        
+        return {
+            'news_count': int(news_count),
+            'compound_sum': float(compound_sum),
+            'bullish_count': int(bullish),
+            'neutral_count': int(neutral),
+            'bearish_count': int(bearish),
+        }
+    
+    def headlines(self, ticker, since=None):
+        """Return ticker's stored headlines from since (all if None), newest first"""
+        query = (
+            'SELECT published_at AS parsed_date, headline, source, compound, category '
+            'FROM headlines WHERE ticker = ?'
+        )
+        params = [ticker]
+        if since is not None:
+            query += ' AND day >= ?'
+            params.append(pd.Timestamp(since).date().isoformat())
+        query += ' ORDER BY published_at DESC'
+        
+        with self.lock:
+            news_df = pd.read_sql_query(query, self.conn, params=params)
+        news_df['parsed_date'] = pd.to_datetime(news_df['parsed_date'])
+        return news_df
+    
+    def needs_rescore(self, lexicon_key):
+        """True if stored scores were made with a different lexicon"""
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'lexicon'").fetchone()
+        return row is None or row[0] != lexicon_key
+    
+    def all_headlines(self):
+        """Return every stored (ticker, hash, headline), e.g. for rescoring"""
+        with self.lock:
+            return self.conn.execute('SELECT ticker, hash, headline FROM headlines').fetchall()
+    
+    def rescore(self, lexicon_key, scores):
+        """Replace stored scores and rebuild the daily totals.
+        
+        scores is an iterable of (ticker, hash, compound, category).
+        """
+        with self.lock, self.conn:
+            self.conn.executemany(
+                'UPDATE headlines SET compound = ?, category = ? WHERE ticker = ? AND hash = ?',
+                [(float(compound), category, ticker, key) for ticker, key, compound, category in scores]
+            )
+            self.conn.execute('DELETE FROM daily')
+            self.conn.execute(
+                'INSERT INTO daily (ticker, day, news_count, compound_sum, bullish, neutral, bearish) '
+                "SELECT ticker, day, COUNT(*), SUM(compound), SUM(category = 'Bullish'), "
+                "SUM(category = 'Neutral'), SUM(category = 'Bearish') FROM headlines GROUP BY ticker, day"
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('lexicon', ?)", (lexicon_key,)
+            )
+
+
+def _json_default(value):
+    """Serialize numpy scalars and other stragglers for json.dumps"""
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+class CheckpointStore:
+    """SQLite store of finished per-ticker analysis, so an interrupted run can resume.
+    
+    Each checkpoint holds the ticker's sentiment scores, its price history
+    and forecast in the form written to the database, and the prediction
+    summary used for shocking predictions. Bulky frames such as
+    news_details are not kept.
+    """
+    
+    _SKIP_FIELDS = ('news_details',)
+    _SERIES_FIELDS = ('historical_data', 'prediction')
+    
+    def __init__(self, cache_dir=None):
+        root = Path(cache_dir or CACHE_DIR)
+        root.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(root / 'checkpoints.sqlite', check_same_thread=False)
+        
+        with self.lock, self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS checkpoints ('
+                'ticker TEXT PRIMARY KEY, saved_at TEXT NOT NULL, payload TEXT NOT NULL)'
+            )
+    
+    def save(self, ticker, result, prediction_summary):
+        """Record a ticker whose sentiment and forecast are complete"""
+        payload = json.dumps({
+            'result': {
+                key: value.to_dict() if isinstance(value, PriceSeries) else value
+                for key, value in result.items() if key not in self._SKIP_FIELDS
+            },
+            'prediction_summary': prediction_summary,
+        }, default=_json_default)
+        
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO checkpoints (ticker, saved_at, payload) VALUES (?, ?, ?)',
+                (ticker, datetime.now().isoformat(), payload)
+            )
+    
+    def load_fresh(self, tickers, max_age_hours=None):
+        """Return {ticker: (result, prediction_summary)} for checkpoints newer than max_age_hours"""
+        if max_age_hours is None:
+            max_age_hours = CHECKPOINT_TTL_HOURS
+        cutoff = (datetime.now() - timedelta(hours=max_age_hours)).isoformat()
+        tickers = list(tickers)
+        found = {}
+        
+        with self.lock:
+            for i in range(0, len(tickers), 500):
+                chunk = tickers[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self.conn.execute(
+                    f'SELECT ticker, payload FROM checkpoints WHERE saved_at >= ? AND ticker IN ({placeholders})',
+                    [cutoff] + chunk
+                ).fetchall()
+                for ticker, payload in rows:
+                    try:
+                        data = json.loads(payload)
+                        result = data['result']
+                        for key in self._SERIES_FIELDS:
+                            if key in result:
+                                result[key] = PriceSeries.from_dict(result[key])
+                        found[ticker] = (result, data['prediction_summary'])
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        
+        return found
+    
+    def clear(self):
+        """Drop all checkpoints (after a run completed cleanly, or to start over)"""
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM checkpoints')
+
+
+class WriteState:
+    """Local record of the rows last written to stock_prices/stock_predictions.
+    
+    Maps ticker -> table -> {date: [values]} so the writer can send only
+    new or changed rows. synced_at marks the last time the record was
+    rebuilt from the database itself. stock_tickers separately tracks which
+    tickers are in the stocks table, so cleanup can skip a full table scan.
+    """
+    
+    def __init__(self, cache_dir=None):
+        self.path = Path(cache_dir or CACHE_DIR) / 'db_state.json'
+        self.lock = threading.Lock()
+        try:
+            with open(self.path) as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {}
+        self.data.setdefault('synced_at', None)
+        self.data.setdefault('tickers', {})
+        self.data.setdefault('stock_tickers', None)
+        self.data.setdefault('stock_tickers_synced_at', None)
+    
+    def is_fresh(self, max_age_hours):
+        synced_at = self.data.get('synced_at')
+        if not synced_at:
+            return False
+        return datetime.now() - datetime.fromisoformat(synced_at) < timedelta(hours=max_age_hours)
+    
+    def reset(self):
+        """Forget all written rows; the stocks ticker manifest is kept"""
+        with self.lock:
+            self.data['synced_at'] = None
+            self.data['tickers'] = {}
+    
+    def mark_synced(self):
+        with self.lock:
+            self.data['synced_at'] = datetime.now().isoformat()
+    
+    def rows(self, ticker, table):
+        """Return {date: [values]} last written for ticker, or None if unknown"""
+        return self.data['tickers'].get(ticker, {}).get(table)
+    
+    def set_rows(self, ticker, table, rows):
+        with self.lock:
+            self.data['tickers'].setdefault(ticker, {})[table] = rows
+    
+    def forget(self, ticker, table=None):
+        """Drop what is known about ticker so its next write is a full replace"""
+        with self.lock:
+            if table is None:
+                self.data['tickers'].pop(ticker, None)
+            else:
+                self.data['tickers'].get(ticker, {}).pop(table, None)
+    
+    def stock_tickers(self, max_age_hours):
+        """Return the set of tickers believed to be in the stocks table, or None if unknown/stale"""
+        synced_at = self.data.get('stock_tickers_synced_at')
+        if self.data.get('stock_tickers') is None or not synced_at:
+            return None
+        if datetime.now() - datetime.fromisoformat(synced_at) >= timedelta(hours=max_age_hours):
+            return None
+        return set(self.data['stock_tickers'])
+    
+    def set_stock_tickers(self, tickers, synced=False):
+        """Record the stocks table's tickers; synced=True when they were just read from the database"""
+        with self.lock:
+            self.data['stock_tickers'] = sorted(tickers)
+            if synced or not self.data.get('stock_tickers_synced_at'):
+                self.data['stock_tickers_synced_at'] = datetime.now().isoformat()
+    
+    def save(self):
+        with self.lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix('.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(self.data, f)
+            tmp_path.replace(self.path)
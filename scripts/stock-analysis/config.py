@@ -15,17 +15,75 @@ SUPABASE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY') or os.getenv('NEXT_PUBLIC_
 if not SUPABASE_URL or not SUPABASE_KEY:
     raise ValueError("Missing required Supabase environment variables")
 
+# Database writes
+DB_WRITE_MODE = os.getenv('DB_WRITE_MODE', 'incremental')  # 'incremental' diffs, 'bulk' replace, or 'per_ticker'
+DB_BATCH_SIZE = int(os.getenv('DB_BATCH_SIZE', '1000'))  # Rows per insert/upsert request
+DB_FILTER_CHUNK_SIZE = int(os.getenv('DB_FILTER_CHUNK_SIZE', '200'))  # Tickers per in_() filter (URL length)
+DB_PAGE_SIZE = int(os.getenv('DB_PAGE_SIZE', '1000'))  # Rows per select page (Supabase max-rows default)
+DB_STATE_TTL_HOURS = float(os.getenv('DB_STATE_TTL_HOURS', '24'))  # Re-read written rows from the DB after this
+DB_STATS_COUNT = os.getenv('DB_STATS_COUNT', 'estimated')  # Server count when no local tally: 'exact', 'planned', 'estimated' or 'off'
+DB_WRITE_WORKERS = int(os.getenv('DB_WRITE_WORKERS', '4'))  # Concurrent clients for per_ticker writes
+DB_RETRY_ATTEMPTS = int(os.getenv('DB_RETRY_ATTEMPTS', '4'))  # Tries per idempotent request on transient errors
+DB_RETRY_BASE_DELAY = float(os.getenv('DB_RETRY_BASE_DELAY', '0.5'))  # Seconds; backoff doubles per attempt
+DB_RETRY_MAX_DELAY = float(os.getenv('DB_RETRY_MAX_DELAY', '8'))  # Cap on a single backoff sleep
+
 # Analysis Configuration
 MAX_STOCKS = int(os.getenv('MAX_STOCKS', '100'))
 DAYS_BACK = int(os.getenv('DAYS_BACK', '90'))  # 3 months of historical data
-PREDICTION_DAYS = int(os.getenv('PREDICTION_DAYS', '30'))  # 1 month of predictions
+PREDICTION_DAYS = int(os.getenv('PREDICTION_DAYS', '30'))  # 1 month of predictions (calendar days; forecast in FORECAST_FREQ steps)
 HISTORICAL_DAYS = 90  # Explicitly set to 90 days (3 months)
+FORECAST_SEED = int(os.environ['FORECAST_SEED']) if os.getenv('FORECAST_SEED') else None  # Set for reproducible forecasts
+FORECAST_MODE = os.getenv('FORECAST_MODE', 'single')  # 'single' noisy path or 'ensemble' Monte Carlo quantiles
+FORECAST_FREQ = os.getenv('FORECAST_FREQ', 'NYSE')  # Forecast steps: 'NYSE' trading sessions, or a pandas offset alias such as 'D'
+ENSEMBLE_PATHS = int(os.getenv('ENSEMBLE_PATHS', '10000'))  # Simulated paths per ticker
+ENSEMBLE_LOWER_PCT = float(os.getenv('ENSEMBLE_LOWER_PCT', '5'))  # Lower bound quantile
+ENSEMBLE_UPPER_PCT = float(os.getenv('ENSEMBLE_UPPER_PCT', '95'))  # Upper bound quantile
+ENSEMBLE_CHUNK_ELEMENTS = int(os.getenv('ENSEMBLE_CHUNK_ELEMENTS', '4000000'))  # Max simulated prices held at once
 
 # Rate Limiting
-REQUEST_DELAY_MIN = float(os.getenv('REQUEST_DELAY_MIN', '1.5'))
-REQUEST_DELAY_MAX = float(os.getenv('REQUEST_DELAY_MAX', '3.0'))
-CHUNK_SIZE = int(os.getenv('CHUNK_SIZE', '5'))
-CHUNK_DELAY = float(os.getenv('CHUNK_DELAY', '5.0'))
+# Per-host budgets as (requests per second, burst). Each host's rate is
+# halved on 429/5xx responses and recovers gradually on success.
+HOST_RATE_LIMITS = {
+    'finviz': (float(os.getenv('FINVIZ_RATE', '1.0')), int(os.getenv('FINVIZ_BURST', '2'))),
+    'yahoo': (float(os.getenv('YAHOO_RATE', '2.0')), int(os.getenv('YAHOO_BURST', '4'))),
+    'wikipedia': (float(os.getenv('WIKIPEDIA_RATE', '2.0')), int(os.getenv('WIKIPEDIA_BURST', '3'))),
+    'yfinance': (float(os.getenv('YFINANCE_RATE', '4.0')), int(os.getenv('YFINANCE_BURST', '8'))),
+    'default': (1.0, 1),
+}
+CHUNK_SIZE = int(os.getenv('CHUNK_SIZE', '5'))  # Tickers per market-cap progress line
+HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', '4'))  # Keep-alive connections per host
+
+# Price history downloads
+PRICE_BATCH_SIZE = int(os.getenv('PRICE_BATCH_SIZE', '50'))  # Tickers per yf.download call
+
+# Local caches (persisted between runs, e.g. via actions/cache in CI)
+CACHE_DIR = Path(os.getenv('CACHE_DIR', Path(__file__).parent / '.cache'))
+PRICE_CACHE_ENABLED = os.getenv('PRICE_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+PRICE_CACHE_TTL_MINUTES = int(os.getenv('PRICE_CACHE_TTL_MINUTES', '30'))  # Refreshed this recently = no request at all
+PRICE_CACHE_FULL_REFRESH_DAYS = int(os.getenv('PRICE_CACHE_FULL_REFRESH_DAYS', '7'))  # Re-download to pick up split/dividend adjustments
+PRICE_CACHE_RETENTION_DAYS = int(os.getenv('PRICE_CACHE_RETENTION_DAYS', '180'))  # Older bars are trimmed
+PRICE_CACHE_EVICT_DAYS = int(os.getenv('PRICE_CACHE_EVICT_DAYS', '14'))  # Tickers unused this long are deleted
+HEADLINE_CACHE_DAYS = int(os.getenv('HEADLINE_CACHE_DAYS', '120'))  # Scored headlines kept this long
+NEWS_STORE_DAYS = int(os.getenv('NEWS_STORE_DAYS', '120'))  # Stored ticker headlines kept this long (keep >= DAYS_BACK)
+UNIVERSE_TTL_HOURS = float(os.getenv('UNIVERSE_TTL_HOURS', '24'))  # Rebuild constituents/market caps daily; 0 disables
+UNIVERSE_MIN_STOCKS = int(os.getenv('UNIVERSE_MIN_STOCKS', '100'))  # Smaller builds are used but not saved as the snapshot
+METRICS_REPORT_PATH = os.getenv('METRICS_REPORT_PATH', str(CACHE_DIR / 'run_report.json'))  # .prom writes a Prometheus textfile; empty disables
+CHECKPOINT_TTL_HOURS = float(os.getenv('CHECKPOINT_TTL_HOURS', '12'))  # --resume reuses tickers analyzed this recently
+
+# Concurrency
+MAX_WORKERS = int(os.getenv('MAX_WORKERS', '8'))  # Tickers processed at once in analyze_top_stocks
+PIPELINE_MODE = os.getenv('PIPELINE_MODE', 'streaming')  # 'streaming' writes each ticker when ready, 'batch' analyzes all first
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', '20'))  # Tickers per forecast/write micro-batch when streaming
+STREAM_QUEUE_SIZE = int(os.getenv('STREAM_QUEUE_SIZE', '32'))  # Max tickers waiting between streaming stages
+STREAM_LINGER_SECONDS = float(os.getenv('STREAM_LINGER_SECONDS', '0.5'))  # Max wait to fill a micro-batch once its first ticker is ready
+
+# News sources queried concurrently for each ticker, with the seconds each
+# may take before its headlines are dropped from that ticker's analysis
+NEWS_SOURCES = [s.strip() for s in os.getenv('NEWS_SOURCES', 'finviz,yahoo').split(',') if s.strip()]
+NEWS_SOURCE_TIMEOUTS = {
+    'finviz': float(os.getenv('FINVIZ_NEWS_TIMEOUT', '30')),
+    'yahoo': float(os.getenv('YAHOO_NEWS_TIMEOUT', '20')),
+}
 
 # User Agents for Web Scraping
 USER_AGENTS = [
@@ -1,125 +1,777 @@
 from supabase import create_client, Client
+from postgrest.exceptions import APIError
+from postgrest.types import ReturnMethod
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import random
+import threading
+import time
+import httpx
 import pandas as pd
-from config import SUPABASE_URL, SUPABASE_KEY
+from config import (
+    SUPABASE_URL, SUPABASE_KEY, DB_WRITE_MODE, DB_BATCH_SIZE, DB_FILTER_CHUNK_SIZE,
+    DB_PAGE_SIZE, DB_STATE_TTL_HOURS, DB_STATS_COUNT, DB_WRITE_WORKERS, DB_RETRY_ATTEMPTS,
+    DB_RETRY_BASE_DELAY, DB_RETRY_MAX_DELAY
+)
+from cache import WriteState
+from results import PriceSeries
+import metrics
 
 
-class DatabaseManager:
+# Value columns compared when diffing rows keyed by (ticker, date)
+TABLE_VALUE_COLUMNS = {
+    'stock_prices': ('price',),
+    'stock_predictions': ('price', 'upper_bound', 'lower_bound'),
+}
+
+
+def _chunks(items, size):
+    """Yield consecutive slices of items with at most size elements"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+# HTTP statuses and Postgres SQLSTATEs worth retrying (throttling, gateway
+# errors, connection loss, serialization failures, statement timeouts)
+_TRANSIENT_STATUS = {'408', '429', '500', '502', '503', '504'}
+_TRANSIENT_SQLSTATE = ('08', '40001', '40P01', '53300', '57014', '57P01')
+
+
+def _is_transient(error):
+    """Return True if error is a network or server hiccup that may succeed on retry"""
+    if isinstance(error, httpx.TransportError):
+        return True
+    if isinstance(error, APIError):
+        code = str(error.code or '')
+        return code in _TRANSIENT_STATUS or code.startswith(_TRANSIENT_SQLSTATE)
+    return False
+
+
+def _with_retries(operation, attempts=None):
+    """Run an idempotent operation, retrying transient failures with jittered backoff.
+    
+    Sleeps a uniform random time up to DB_RETRY_BASE_DELAY * 2**n (capped at
+    DB_RETRY_MAX_DELAY) between tries so concurrent writers do not retry in
+    lockstep. Returns (result, attempts_used); re-raises the last error.
+    """
+    attempts = max(1, attempts or DB_RETRY_ATTEMPTS)
+    for attempt in range(1, attempts + 1):
+        try:
+            result = operation()
+            metrics.incr('db.retries', attempt - 1)
+            return result, attempt
+        except Exception as e:
+            if attempt == attempts or not _is_transient(e):
+                metrics.incr('db.retries', attempt - 1)
+                metrics.incr('db.failures')
+                e.attempts = attempt
+                raise
+            time.sleep(random.uniform(0, min(DB_RETRY_MAX_DELAY, DB_RETRY_BASE_DELAY * 2 ** (attempt - 1))))
+
+
+class WriteResult:
+    """Outcome of a per-ticker write: tickers written and, for each failure,
+    the stage it stopped at ('prepare', 'stock', 'prices' or 'predictions'),
+    the error and how many attempts were made.
+    """
+    
     def __init__(self):
+        self.succeeded = []
+        self.failures = {}
+        self.retries = 0
+        self.lock = threading.Lock()
+    
+    def record_success(self, ticker, retries=0):
+        with self.lock:
+            self.succeeded.append(ticker)
+            self.retries += retries
+    
+    def record_failure(self, ticker, stage, error, retries=0):
+        with self.lock:
+            self.failures[ticker] = {
+                'stage': stage,
+                'error': str(error),
+                'attempts': getattr(error, 'attempts', 1),
+            }
+            self.retries += retries
+    
+    @property
+    def success_count(self):
+        return len(self.succeeded)
+    
+    @property
+    def error_count(self):
+        return len(self.failures)
+    
+    def failed_by_stage(self):
+        """Return {stage: [tickers]} for the failed tickers"""
+        stages = {}
+        for ticker, failure in sorted(self.failures.items()):
+            stages.setdefault(failure['stage'], []).append(ticker)
+        return stages
+    
+    def merge(self, other):
+        """Add another result's outcomes (e.g. from a later batch) to this one"""
+        with self.lock:
+            self.succeeded.extend(other.succeeded)
+            self.failures.update(other.failures)
+            self.retries += other.retries
+    
+    def to_dict(self):
+        return {
+            'succeeded': sorted(self.succeeded),
+            'failures': dict(sorted(self.failures.items())),
+            'retries': self.retries,
+        }
+
+
+class DatabaseManager:
+    def __init__(self, client=None, client_factory=None):
+        """Connect to Supabase, or use an injected client.
+        
+        client can be any PostgREST-compatible client exposing .table(),
+        e.g. create_client() pointed at a local PostgREST/Supabase stack.
+        client_factory, if given, builds one extra client per writer thread;
+        without it an injected client is shared by all threads. Per-ticker
+        writes run on one pool of DB_WRITE_WORKERS threads kept for the
+        manager's lifetime, so at most that many extra clients exist; call
+        close() when done.
+        """
+        self.last_write_result = None
+        self._local = threading.local()
+        self._writer_lock = threading.Lock()
+        self._writer_pool = None
+        self._writer_clients = []
+        
+        if client is not None:
+            self.supabase = client
+            self._client_factory = client_factory
+            return
+        
         if not SUPABASE_URL or not SUPABASE_KEY:
             raise ValueError("Missing Supabase credentials")
         
         self.supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+        self._client_factory = client_factory or (lambda: create_client(SUPABASE_URL, SUPABASE_KEY))
     
-    def upsert_stock_data(self, stock_data):
-        """Insert or update complete stock data in Supabase"""
-        try:
-            ticker = stock_data['ticker']
-            print(f"  Upserting {ticker}...")
+    def _thread_client(self):
+        """Return this thread's own client so parallel writers do not share a connection"""
+        if self._client_factory is None:
+            return self.supabase
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self._client_factory()
+            with self._writer_lock:
+                self._writer_clients.append(client)
+        return client
+    
+    def _writers(self):
+        """Return the shared per-ticker writer pool, starting it on first use"""
+        with self._writer_lock:
+            if self._writer_pool is None:
+                self._writer_pool = ThreadPoolExecutor(
+                    max_workers=max(1, DB_WRITE_WORKERS), thread_name_prefix='db-writer'
+                )
+            return self._writer_pool
+    
+    def close(self):
+        """Stop the writer pool and close the clients its threads opened"""
+        with self._writer_lock:
+            pool, self._writer_pool = self._writer_pool, None
+            clients, self._writer_clients = self._writer_clients, []
+        
+        if pool is not None:
+            pool.shutdown(wait=True)
+        for client in clients:
+            session = getattr(getattr(client, 'postgrest', None), 'session', None)
+            if session is not None and hasattr(session, 'close'):
+                try:
+                    session.close()
+                except Exception:
+                    pass
+    
+    def _stock_row(self, stock_data):
+        """Build the stocks table row matching existing schema"""
+        return {
+            'ticker': stock_data['ticker'],
+            'name': stock_data['name'],
+            'sentiment': {
+                'score': float(stock_data.get('sentiment_score', 0)),
+                'category': stock_data.get('sentiment_category', 'Neutral'),
+                'investment_score': float(stock_data.get('investment_score', 0))
+            },
+            'news_count': int(stock_data.get('news_count', 0)),
+            'rank': int(stock_data.get('rank', 0)),
+            'investment_score': float(stock_data.get('investment_score', 0)),
+            'last_updated': datetime.now().isoformat()
+        }
+    
+    def _price_rows(self, stock_data):
+        """Build stock_prices rows from the historical_data PriceSeries"""
+        history = stock_data.get('historical_data')
+        return history.to_rows(stock_data['ticker']) if isinstance(history, PriceSeries) else []
+    
+    def _prediction_rows(self, stock_data):
+        """Build stock_predictions rows (price plus bounds) from the prediction PriceSeries"""
+        prediction = stock_data.get('prediction')
+        return prediction.to_rows(stock_data['ticker']) if isinstance(prediction, PriceSeries) else []
+    
+    def stock_data_from_row(self, stock, rank):
+        """Convert a ranked_stocks row into the dict consumed by the writers"""
+        return {
+            'ticker': stock['ticker'],
+            'name': stock['name'],
+            'sentiment_score': float(stock.get('avg_sentiment', 0)),
+            'sentiment_category': stock.get('sentiment_category', 'Neutral'),
+            'investment_score': float(stock.get('investment_score', 0)),
+            'news_count': int(stock.get('news_count', 0)),
+            'rank': rank,  # Sequential 1-based ranking starting from 1
+            'historical_data': stock.get('historical_data'),
+            'prediction': stock.get('prediction')
+        }
+    
+    def _write_ticker(self, stock_data, result, stock_rows=True):
+        """Write one stock in three retried stages, recording the outcome in result.
+        
+        Each stage is idempotent as a whole: the stock row is upserted, and
+        prices/predictions are deleted before being re-inserted, so a retry
+        after a partial failure cannot leave duplicates behind. With
+        stock_rows=False the stock row stage is skipped.
+        """
+        ticker = stock_data['ticker']
+        client = self._thread_client()
+        retries = 0
+        
+        def write_stock():
+            client.table('stocks').upsert(
+                self._stock_row(stock_data), on_conflict='ticker', returning=ReturnMethod.minimal
+            ).execute()
+        
+        def replace(table, rows):
+            def operation():
+                client.table(table).delete(returning=ReturnMethod.minimal).eq('ticker', ticker).execute()
+                for chunk in _chunks(rows, DB_BATCH_SIZE):
+                    client.table(table).insert(chunk, returning=ReturnMethod.minimal).execute()
+                metrics.incr('db.rows_written', len(rows), table=table)
+            return operation
+        
+        stages = [('stock', write_stock)] if stock_rows else []
+        price_rows = self._price_rows(stock_data)
+        if price_rows:
+            stages.append(('prices', replace('stock_prices', price_rows)))
+        prediction_rows = self._prediction_rows(stock_data)
+        if prediction_rows:
+            stages.append(('predictions', replace('stock_predictions', prediction_rows)))
+        
+        for stage, operation in stages:
+            try:
+                with metrics.span('ticker.write', ticker=ticker, stage=stage):
+                    _, attempts = _with_retries(operation)
+                retries += attempts - 1
+            except Exception as e:
+                retries += getattr(e, 'attempts', 1) - 1
+                result.record_failure(ticker, stage, e, retries)
+                print(f"  ✗ {ticker}: {stage} failed after {getattr(e, 'attempts', 1)} attempt(s): {e}")
+                return
+        
+        result.record_success(ticker, retries)
+        print(f"  ✓ {ticker}: {len(price_rows)} prices, {len(prediction_rows)} predictions"
+              + (f" ({retries} retries)" if retries else ""))
+    
+    @metrics.timed('db', op='write_parallel')
+    def write_stocks_parallel(self, stocks_data, result=None, stock_rows=True):
+        """Write stocks one ticker at a time on the shared writer pool.
+        
+        Returns a WriteResult listing the tickers written and, for failures,
+        the stage that failed.
+        """
+        result = result or WriteResult()
+        list(self._writers().map(lambda stock_data: self._write_ticker(stock_data, result, stock_rows), stocks_data))
+        return result
+    
+    def _replace_rows(self, table, rows_by_ticker, results, state=None):
+        """Replace all rows of table for the given tickers with one delete and batched inserts.
+        
+        Tickers whose delete or insert batch fails are marked False in results.
+        Returns the number of rows inserted.
+        """
+        tickers = [ticker for ticker in rows_by_ticker if results.get(ticker)]
+        if not tickers:
+            return 0
+        
+        deleted = []
+        for ticker_chunk in _chunks(tickers, DB_FILTER_CHUNK_SIZE):
+            try:
+                self.supabase.table(table).delete(returning=ReturnMethod.minimal).in_('ticker', ticker_chunk).execute()
+                deleted.extend(ticker_chunk)
+            except Exception as e:
+                print(f"    ✗ Could not clear {table} for {len(ticker_chunk)} tickers: {e}")
+                for ticker in ticker_chunk:
+                    results[ticker] = False
+        
+        # Rows stay grouped by ticker, so a failed batch only touches a few tickers
+        rows = [row for ticker in deleted for row in rows_by_ticker[ticker]]
+        inserted = 0
+        for batch in _chunks(rows, DB_BATCH_SIZE):
+            try:
+                self.supabase.table(table).insert(batch, returning=ReturnMethod.minimal).execute()
+                inserted += len(batch)
+                metrics.incr('db.rows_written', len(batch), table=table)
+            except Exception as e:
+                batch_tickers = sorted({row['ticker'] for row in batch})
+                print(f"    ✗ Could not insert {len(batch)} {table} rows ({', '.join(batch_tickers)}): {e}")
+                for ticker in batch_tickers:
+                    results[ticker] = False
+        
+        if state is not None:
+            value_columns = TABLE_VALUE_COLUMNS[table]
+            for ticker in deleted:
+                if results[ticker]:
+                    state.set_rows(ticker, table, {
+                        row['date']: [row[column] for column in value_columns]
+                        for row in rows_by_ticker[ticker]
+                    })
+                else:
+                    state.forget(ticker, table)
+        
+        return inserted
+    
+    def _sync_rows(self, table, rows_by_ticker, results, state):
+        """Write only new or changed (ticker, date) rows and delete dates that left the window.
+        
+        Compares against the rows last written (from state). Tickers with no
+        known state, or whose upsert batch fails (e.g. no unique (ticker, date)
+        constraint), fall back to _replace_rows. Returns the rows written.
+        """
+        value_columns = TABLE_VALUE_COLUMNS[table]
+        replace = {}
+        upserts = []
+        current_by_ticker = {}
+        aged_out = {}  # cutoff date -> tickers with rows older than their new window
+        gaps = {}  # ticker -> dates missing inside the new window (rare)
+        
+        for ticker, rows in rows_by_ticker.items():
+            if not results.get(ticker):
+                continue
             
-            # Prepare stock data matching existing schema
-            stock = {
-                'ticker': ticker,
-                'name': stock_data['name'],
-                'sentiment': {
-                    'score': float(stock_data.get('sentiment_score', 0)),
-                    'category': stock_data.get('sentiment_category', 'Neutral'),
-                    'investment_score': float(stock_data.get('investment_score', 0))
-                },
-                'news_count': int(stock_data.get('news_count', 0)),
-                'rank': int(stock_data.get('rank', 0)),
-                'investment_score': float(stock_data.get('investment_score', 0)),
-                'last_updated': datetime.now().isoformat()
-            }
+            previous = state.rows(ticker, table)
+            if previous is None:
+                replace[ticker] = rows
+                continue
             
-            # Upsert stock data (ticker is primary key)
-            self.supabase.table('stocks').upsert(stock, on_conflict='ticker').execute()
-            print(f"    ✓ Stock data upserted")
-
-            # Handle historical prices
-            historical_count = 0
-            if stock_data.get('historical_data') and len(stock_data['historical_data']) > 0:
-                # Delete existing historical data
-                self.supabase.table('stock_prices').delete().eq('ticker', ticker).execute()
-                
-                # Prepare historical data
-                historical_data = [
-                    {
-                        'ticker': ticker,
-                        'date': price['date'],
-                        'price': float(price['price'])
-                    }
-                    for price in stock_data['historical_data']
-                ]
-                
-                # Log date range
-                if historical_data:
-                    dates = [d['date'] for d in historical_data]
-                    print(f"    Historical prices: {min(dates)} to {max(dates)}")
-                
-                # Insert new historical data in chunks
-                chunk_size = 100
-                for i in range(0, len(historical_data), chunk_size):
-                    chunk = historical_data[i:i + chunk_size]
-                    self.supabase.table('stock_prices').insert(chunk).execute()
-                    historical_count += len(chunk)
-                
-                print(f"    ✓ Inserted {historical_count} historical prices")
+            current = {row['date']: [row[column] for column in value_columns] for row in rows}
+            current_by_ticker[ticker] = current
+            upserts.extend(row for row in rows if previous.get(row['date']) != current[row['date']])
+            
+            cutoff = min(current)
+            stale = [date for date in previous if date not in current]
+            if any(date < cutoff for date in stale):
+                aged_out.setdefault(cutoff, []).append(ticker)
+            holes = [date for date in stale if date >= cutoff]
+            if holes:
+                gaps[ticker] = holes
+        
+        deleted_groups = 0
+        for cutoff, tickers in aged_out.items():
+            for ticker_chunk in _chunks(tickers, DB_FILTER_CHUNK_SIZE):
+                try:
+                    self.supabase.table(table).delete(returning=ReturnMethod.minimal) \
+                        .in_('ticker', ticker_chunk).lt('date', cutoff).execute()
+                    deleted_groups += 1
+                except Exception as e:
+                    print(f"    ✗ Could not delete aged-out {table} rows before {cutoff}: {e}")
+                    for ticker in ticker_chunk:
+                        results[ticker] = False
+        
+        for ticker, dates in gaps.items():
+            try:
+                self.supabase.table(table).delete(returning=ReturnMethod.minimal) \
+                    .eq('ticker', ticker).in_('date', dates).execute()
+            except Exception as e:
+                print(f"    ✗ Could not delete stale {table} rows for {ticker}: {e}")
+                results[ticker] = False
+        
+        written = 0
+        for batch in _chunks(upserts, DB_BATCH_SIZE):
+            try:
+                self.supabase.table(table).upsert(
+                    batch, on_conflict='ticker,date', returning=ReturnMethod.minimal
+                ).execute()
+                written += len(batch)
+                metrics.incr('db.rows_written', len(batch), table=table)
+            except Exception as e:
+                batch_tickers = sorted({row['ticker'] for row in batch})
+                print(f"    ⚠ Upsert of {len(batch)} {table} rows failed, replacing {len(batch_tickers)} tickers instead: {e}")
+                for ticker in batch_tickers:
+                    replace[ticker] = rows_by_ticker[ticker]
+                    current_by_ticker.pop(ticker, None)
+        
+        for ticker, current in current_by_ticker.items():
+            if results[ticker]:
+                state.set_rows(ticker, table, current)
             else:
-                print(f"    ⚠ No historical data for {ticker}")
-
-            # Handle predictions
-            prediction_count = 0
-            if stock_data.get('prediction') and stock_data['prediction'].get('data') and len(stock_data['prediction']['data']) > 0:
-                # Delete existing predictions
-                self.supabase.table('stock_predictions').delete().eq('ticker', ticker).execute()
-                
-                predictions = []
-                pred_data_list = stock_data['prediction']['data']
-                upper_bound_list = stock_data['prediction'].get('upper_bound', [])
-                lower_bound_list = stock_data['prediction'].get('lower_bound', [])
-                
-                for i in range(len(pred_data_list)):
-                    pred_data = pred_data_list[i]
-                    upper = upper_bound_list[i] if i < len(upper_bound_list) else None
-                    lower = lower_bound_list[i] if i < len(lower_bound_list) else None
-                    
-                    predictions.append({
-                        'ticker': ticker,
-                        'date': pred_data['date'],
-                        'price': float(pred_data['price']),
-                        'upper_bound': float(upper['price']) if upper and 'price' in upper else None,
-                        'lower_bound': float(lower['price']) if lower and 'price' in lower else None
-                    })
-                
-                # Log date range
-                if predictions:
-                    dates = [p['date'] for p in predictions]
-                    print(f"    Predictions: {min(dates)} to {max(dates)}")
-                
-                # Insert new predictions in chunks
-                chunk_size = 100
-                for i in range(0, len(predictions), chunk_size):
-                    chunk = predictions[i:i + chunk_size]
-                    self.supabase.table('stock_predictions').insert(chunk).execute()
-                    prediction_count += len(chunk)
-                
-                print(f"    ✓ Inserted {prediction_count} predictions")
+                state.forget(ticker, table)
+        
+        written += self._replace_rows(table, replace, results, state)
+        
+        print(f"  ✓ {table}: {len(upserts)} new/changed rows upserted, "
+              f"{deleted_groups + len(gaps)} delete requests, {len(replace)} tickers fully replaced")
+        return written
+    
+    def _select_all(self, table, columns, tickers):
+        """Select columns for tickers, following pagination past the max-rows limit"""
+        rows = []
+        for ticker_chunk in _chunks(tickers, DB_FILTER_CHUNK_SIZE):
+            offset = 0
+            while True:
+                page = self.supabase.table(table).select(','.join(columns)) \
+                    .in_('ticker', ticker_chunk).order('ticker').order('date') \
+                    .range(offset, offset + DB_PAGE_SIZE - 1).execute().data
+                rows.extend(page)
+                if len(page) < DB_PAGE_SIZE:
+                    break
+                offset += DB_PAGE_SIZE
+        return rows
+    
+    @metrics.timed('db', op='load_state')
+    def _load_write_state(self, tickers):
+        """Return the local WriteState with rows for tickers, reading from the database what it lacks.
+        
+        A stale state is reset first. Only the given tickers are read, so when
+        streaming each micro-batch rebuilds its own tickers and is still
+        diffed rather than fully replaced.
+        """
+        state = WriteState()
+        if not state.is_fresh(DB_STATE_TTL_HOURS):
+            print("  Write state is stale, rebuilding from database...")
+            state.reset()
+            state.mark_synced()
+        
+        missing = [
+            ticker for ticker in tickers
+            if any(state.rows(ticker, table) is None for table in TABLE_VALUE_COLUMNS)
+        ]
+        if not missing:
+            return state
+        
+        try:
+            for table, value_columns in TABLE_VALUE_COLUMNS.items():
+                grouped = {ticker: {} for ticker in missing}
+                for row in self._select_all(table, ('ticker', 'date') + value_columns, missing):
+                    grouped.setdefault(row['ticker'], {})[str(row['date'])[:10]] = [
+                        float(row[column]) if row[column] is not None else None
+                        for column in value_columns
+                    ]
+                for ticker, rows in grouped.items():
+                    state.set_rows(ticker, table, rows)
+        except Exception as e:
+            print(f"  ⚠ Could not read existing rows for {len(missing)} tickers, replacing them: {e}")
+            for ticker in missing:
+                state.forget(ticker)
+        
+        return state
+    
+    @metrics.timed('db', op='upsert_stocks')
+    def upsert_stock_rows(self, stocks_data, results=None):
+        """Upsert only the stocks table rows (e.g. to publish final ranks); return {ticker: success}"""
+        if results is None:
+            results = {stock_data['ticker']: True for stock_data in stocks_data}
+        
+        stock_rows = [self._stock_row(stock_data) for stock_data in stocks_data]
+        for batch in _chunks(stock_rows, DB_BATCH_SIZE):
+            try:
+                _with_retries(lambda: self.supabase.table('stocks').upsert(
+                    batch, on_conflict='ticker', returning=ReturnMethod.minimal
+                ).execute())
+            except Exception as e:
+                print(f"    ✗ Could not upsert {len(batch)} stock rows: {e}")
+                for row in batch:
+                    results[row['ticker']] = False
+        
+        return results
+    
+    @metrics.timed('db', op='add_stocks')
+    def add_stock_rows(self, stocks_data):
+        """Upsert stock rows for tickers new to the table and record them in the manifest.
+        
+        Lets a new ticker's prices and predictions (which reference its stocks
+        row) be written before its final rank is known, while cleanup can
+        still find it if the run stops early. Returns {ticker: success}.
+        """
+        results = self.upsert_stock_rows(stocks_data)
+        
+        state = WriteState()
+        tickers = state.stock_tickers(DB_STATE_TTL_HOURS)
+        if tickers is not None:
+            state.set_stock_tickers(tickers | {ticker for ticker, ok in results.items() if ok})
+            try:
+                state.save()
+            except OSError as e:
+                print(f"  ⚠ Could not save write state: {e}")
+        return results
+    
+    @metrics.timed('db', op='bulk_write')
+    def bulk_upsert_stock_data(self, stocks_data, incremental=False, upserted=None, stock_rows=True):
+        """Write many stocks with set-based requests instead of one round trip chain per ticker.
+        
+        Upserts all stock rows together, then replaces stock_prices and
+        stock_predictions for every ticker with one in_() delete plus large
+        batched inserts. With incremental=True only rows that differ from the
+        last write are sent (see _sync_rows). Returns {ticker: success}; the
+        tickers whose stock row was upserted are added to upserted if given.
+        With stock_rows=False only prices and predictions are written.
+        """
+        results = {stock_data['ticker']: True for stock_data in stocks_data}
+        state = self._load_write_state(list(results)) if incremental else None
+        
+        # Stock rows (ticker is primary key)
+        if stock_rows:
+            self.upsert_stock_rows(stocks_data, results)
+            if upserted is not None:
+                upserted.update(ticker for ticker, ok in results.items() if ok)
+            print(f"  ✓ Upserted {sum(results.values())} stock rows")
+        
+        # Historical prices
+        price_rows = {}
+        for stock_data in stocks_data:
+            rows = self._price_rows(stock_data)
+            if rows:
+                price_rows[stock_data['ticker']] = rows
             else:
-                print(f"    ⚠ No prediction data for {ticker}")
-
-            print(f"  ✓ {ticker} complete: {historical_count} prices, {prediction_count} predictions")
-            return True
-
+                print(f"    ⚠ No historical data for {stock_data['ticker']}")
+        
+        if incremental:
+            price_count = self._sync_rows('stock_prices', price_rows, results, state)
+        else:
+            price_count = self._replace_rows('stock_prices', price_rows, results)
+        print(f"  ✓ Wrote {price_count} historical prices for {len(price_rows)} stocks")
+        
+        # Predictions
+        prediction_rows = {}
+        for stock_data in stocks_data:
+            rows = self._prediction_rows(stock_data)
+            if rows:
+                prediction_rows[stock_data['ticker']] = rows
+            else:
+                print(f"    ⚠ No prediction data for {stock_data['ticker']}")
+        
+        if incremental:
+            prediction_count = self._sync_rows('stock_predictions', prediction_rows, results, state)
+        else:
+            prediction_count = self._replace_rows('stock_predictions', prediction_rows, results)
+        print(f"  ✓ Wrote {prediction_count} predictions for {len(prediction_rows)} stocks")
+        
+        if state is not None:
+            try:
+                state.save()
+            except OSError as e:
+                print(f"  ⚠ Could not save write state: {e}")
+        
+        return results
+    
+    def _existing_stock_tickers(self, state):
+        """Return the tickers in the stocks table, from the local manifest when fresh.
+        
+        Falls back to reading the ticker column (paginated) and refreshes the
+        manifest from it. Returns None if the table could not be read.
+        """
+        tickers = state.stock_tickers(DB_STATE_TTL_HOURS)
+        if tickers is not None:
+            return tickers
+        
+        try:
+            tickers = set()
+            offset = 0
+            while True:
+                page = self.supabase.table('stocks').select('ticker').order('ticker') \
+                    .range(offset, offset + DB_PAGE_SIZE - 1).execute().data
+                tickers.update(row['ticker'] for row in page)
+                if len(page) < DB_PAGE_SIZE:
+                    break
+                offset += DB_PAGE_SIZE
         except Exception as e:
-            print(f"  ✗ Error upserting stock data for {stock_data.get('ticker', 'unknown')}: {e}")
-            import traceback
-            traceback.print_exc()
-            return False
+            print(f"  ⚠ Could not clean up old stocks: {e}")
+            return None
+        
+        state.set_stock_tickers(tickers, synced=True)
+        return tickers
     
-    def write_analysis_to_database(self, ranked_stocks, shocking_predictions=None):
+    def stock_tickers(self):
+        """Return the tickers in the stocks table (see _existing_stock_tickers), or None if unknown"""
+        state = WriteState()
+        tickers = self._existing_stock_tickers(state)
+        try:
+            state.save()
+        except OSError as e:
+            print(f"  ⚠ Could not save write state: {e}")
+        return tickers
+    
+    def _remove_stale_tickers(self, tickers_to_remove, state):
+        """Delete tickers from every table with one in_() delete per table and chunk.
+        
+        Dependent rows go first so a failure never leaves prices or predictions
+        behind for a removed stock. Returns the set of tickers removed.
+        """
+        if not tickers_to_remove:
+            return set()
+        
+        print(f"\nCleaning up {len(tickers_to_remove)} old stocks not in new analysis...")
+        removed = set()
+        for ticker_chunk in _chunks(sorted(tickers_to_remove), DB_FILTER_CHUNK_SIZE):
+            try:
+                for table in ('stock_prices', 'stock_predictions', 'stocks'):
+                    # Deletes are idempotent, so retry them
+                    _with_retries(lambda: self.supabase.table(table).delete(returning=ReturnMethod.minimal)
+                                  .in_('ticker', ticker_chunk).execute())
+            except Exception as e:
+                print(f"  ⚠ Could not remove {', '.join(ticker_chunk)}: {e}")
+                continue
+            
+            for ticker in ticker_chunk:
+                state.forget(ticker)
+            removed.update(ticker_chunk)
+        
+        if removed:
+            print(f"  ✓ Removed {len(removed)} stocks: {', '.join(sorted(removed))}")
+        return removed
+    
+    def _tally_from_state(self, state):
+        """Count rows from the local write state, or None if it does not cover every ticker"""
+        tickers = state.stock_tickers(DB_STATE_TTL_HOURS)
+        if tickers is None or not state.is_fresh(DB_STATE_TTL_HOURS):
+            return None
+        
+        counts = {'stocks': len(tickers)}
+        for table in TABLE_VALUE_COLUMNS:
+            total = 0
+            for ticker in tickers:
+                rows = state.rows(ticker, table)
+                if rows is None:
+                    return None
+                total += len(rows)
+            counts[table] = total
+        return counts
+    
+    @metrics.timed('db', op='statistics')
+    def get_statistics(self, state=None, count=None):
+        """Return row counts for stocks, stock_prices and stock_predictions.
+        
+        Uses the local tally kept by the incremental writer when it is fresh
+        and complete; otherwise asks the server for head-only counts (no rows
+        transferred) using count ('exact', 'planned' or 'estimated', default
+        DB_STATS_COUNT). Returns {} when counts are disabled or unavailable.
+        """
+        counts = self._tally_from_state(state) if state is not None else None
+        if counts is not None:
+            counts['source'] = 'local tally'
+            return counts
+        
+        count = count or DB_STATS_COUNT
+        if count == 'off':
+            return {}
+        
+        counts = {'source': f'{count} count'}
+        for table in ('stocks', 'stock_prices', 'stock_predictions'):
+            try:
+                result = self.supabase.table(table).select('ticker', count=count, head=True).execute()
+                counts[table] = result.count
+            except Exception as e:
+                print(f"  Could not fetch database statistics for {table}: {e}")
+        return counts
+    
+    @metrics.timed('db', op='cleanup')
+    def remove_stale_stocks(self, new_tickers):
+        """Remove stocks that are not in new_tickers; return the tickers left in the stocks table.
+        
+        Returns None when the existing tickers could not be determined.
+        """
+        state = WriteState()
+        existing_tickers = self._existing_stock_tickers(state)
+        if existing_tickers is not None:
+            removed = self._remove_stale_tickers(existing_tickers - set(new_tickers), state)
+            existing_tickers -= removed
+        try:
+            state.save()
+        except OSError as e:
+            print(f"  ⚠ Could not save write state: {e}")
+        return existing_tickers
+    
+    def write_stocks(self, stocks_data, mode=None, upserted=None, stock_rows=True):
+        """Write prepared stock dicts with the given DB_WRITE_MODE; return {ticker: success}.
+        
+        Tickers whose stock row was upserted (even if their prices or
+        predictions then failed) are added to upserted if given. With
+        stock_rows=False the stocks table is left alone (e.g. until final
+        ranks are known) and only prices and predictions are written.
+        """
+        mode = mode or DB_WRITE_MODE
+        
+        if mode in ('bulk', 'incremental'):
+            results = self.bulk_upsert_stock_data(
+                stocks_data, incremental=mode == 'incremental', upserted=upserted, stock_rows=stock_rows
+            )
+            failed = [ticker for ticker, ok in results.items() if not ok]
+            if failed:
+                print(f"  ✗ Failed tickers: {', '.join(failed)}")
+            return results
+        
+        result = self.write_stocks_parallel(stocks_data, stock_rows=stock_rows)
+        for stage, tickers in result.failed_by_stage().items():
+            print(f"  ✗ Failed at {stage}: {', '.join(tickers)}")
+        if self.last_write_result is not None:
+            self.last_write_result.merge(result)
+        if upserted is not None and stock_rows:
+            upserted.update(
+                stock_data['ticker'] for stock_data in stocks_data
+                if result.failures.get(stock_data['ticker'], {}).get('stage') != 'stock'
+            )
+        return {stock_data['ticker']: stock_data['ticker'] not in result.failures for stock_data in stocks_data}
+    
+    def finish_write(self, upserted_tickers, existing_tickers, mode=None):
+        """Record which tickers the stocks table now holds and return the state used for statistics.
+        
+        upserted_tickers are the tickers whose stock row this run wrote and
+        existing_tickers those already in the table after cleanup, so the
+        recorded set (and the stocks count tallied from it) is exact.
+        """
+        mode = mode or DB_WRITE_MODE
+        
+        # Reload: the writers may have saved their own changes to the state file
+        state = WriteState()
+        if existing_tickers is not None:
+            state.set_stock_tickers(existing_tickers | set(upserted_tickers))
+        if mode != 'incremental':
+            # Rows were rewritten outside the diff writer; make the next incremental run resync
+            state.reset()
+        try:
+            state.save()
+        except OSError as e:
+            print(f"  ⚠ Could not save write state: {e}")
+        return state
+    
+    def print_write_summary(self, success_count, error_count, state=None):
+        """Print the write totals followed by row counts from get_statistics()"""
+        print(f"\n{'='*70}")
+        print(f"Database Write Summary:")
+        print(f"{'='*70}")
+        print(f"✓ Successfully wrote {success_count} stocks")
+        print(f"✗ Failed to write {error_count} stocks")
+        
+        # Get some statistics from database
+        stats = self.get_statistics(state)
+        if stats:
+            print(f"\nDatabase Statistics ({stats['source']}):")
+            print(f"  Total stocks in DB: {stats.get('stocks', 'N/A')}")
+            print(f"  Total price records: {stats.get('stock_prices', 'N/A')}")
+            print(f"  Total prediction records: {stats.get('stock_predictions', 'N/A')}")
+        
+        print(f"{'='*70}\n")
+    
+    def write_analysis_to_database(self, ranked_stocks, shocking_predictions=None, mode=None):
         """Write complete analysis results to database"""
-        success_count = 0
+        if mode is None:
+            mode = DB_WRITE_MODE
+        
         error_count = 0
         
         print(f"\nWriting {len(ranked_stocks)} stocks to database...")
@@ -128,77 +780,30 @@ class DatabaseManager:
         new_tickers = set(ranked_stocks['ticker'].tolist())
         
         # Clean up old stocks not in this analysis (prevents duplicates/stale data)
-        try:
-            existing_stocks = self.supabase.table('stocks').select('ticker').execute()
-            existing_tickers = set(stock['ticker'] for stock in existing_stocks.data)
-            
-            # Find tickers to remove (were in DB but not in new analysis)
-            tickers_to_remove = existing_tickers - new_tickers
-            
-            if tickers_to_remove:
-                print(f"\nCleaning up {len(tickers_to_remove)} old stocks not in new analysis...")
-                for ticker in tickers_to_remove:
-                    try:
-                        # Delete associated data
-                        self.supabase.table('stock_prices').delete().eq('ticker', ticker).execute()
-                        self.supabase.table('stock_predictions').delete().eq('ticker', ticker).execute()
-                        self.supabase.table('stocks').delete().eq('ticker', ticker).execute()
-                        print(f"  ✓ Removed {ticker}")
-                    except Exception as e:
-                        print(f"  ⚠ Could not remove {ticker}: {e}")
-        except Exception as e:
-            print(f"  ⚠ Could not clean up old stocks: {e}")
+        existing_tickers = self.remove_stale_stocks(new_tickers)
+        
+        self.last_write_result = WriteResult() if mode == 'per_ticker' else None
         
         # Ensure unique ranks 1-N
+        stocks_data = []
         for rank, (idx, stock) in enumerate(ranked_stocks.iterrows(), start=1):
             try:
-                # Prepare stock data
-                stock_data = {
-                    'ticker': stock['ticker'],
-                    'name': stock['name'],
-                    'sentiment_score': float(stock.get('avg_sentiment', 0)),
-                    'sentiment_category': stock.get('sentiment_category', 'Neutral'),
-                    'investment_score': float(stock.get('investment_score', 0)),
-                    'news_count': int(stock.get('news_count', 0)),
-                    'rank': rank,  # Sequential 1-based ranking starting from 1
-                    'historical_data': stock.get('historical_data', []),
-                    'prediction': stock.get('prediction', {
-                        'data': [],
-                        'upper_bound': [],
-                        'lower_bound': []
-                    })
-                }
-                
-                if self.upsert_stock_data(stock_data):
-                    success_count += 1
-                else:
-                    error_count += 1
-                    
+                stocks_data.append(self.stock_data_from_row(stock, rank))
             except Exception as e:
                 print(f"  ✗ Error processing {stock.get('ticker', 'unknown')}: {str(e)}")
-                import traceback
-                traceback.print_exc()
                 error_count += 1
+                if self.last_write_result is not None:
+                    self.last_write_result.record_failure(stock.get('ticker', 'unknown'), 'prepare', e)
         
-        print(f"\n{'='*70}")
-        print(f"Database Write Summary:")
-        print(f"{'='*70}")
-        print(f"✓ Successfully wrote {success_count} stocks")
-        print(f"✗ Failed to write {error_count} stocks")
+        upserted = set()
+        results = self.write_stocks(stocks_data, mode=mode, upserted=upserted)
+        success_count = sum(1 for ok in results.values() if ok)
+        error_count += len(results) - success_count
         
-        # Get some statistics from database
-        try:
-            stocks_result = self.supabase.table('stocks').select('ticker').execute()
-            prices_result = self.supabase.table('stock_prices').select('ticker', count='exact').execute()
-            predictions_result = self.supabase.table('stock_predictions').select('ticker', count='exact').execute()
-            
-            print(f"\nDatabase Statistics:")
-            print(f"  Total stocks in DB: {len(stocks_result.data)}")
-            print(f"  Total price records: {prices_result.count if hasattr(prices_result, 'count') else 'N/A'}")
-            print(f"  Total prediction records: {predictions_result.count if hasattr(predictions_result, 'count') else 'N/A'}")
-        except Exception as e:
-            print(f"  Could not fetch database statistics: {e}")
+        if mode == 'per_ticker' and self.last_write_result.retries:
+            print(f"  ↻ {self.last_write_result.retries} transient errors retried")
         
-        print(f"{'='*70}\n")
+        state = self.finish_write(upserted, existing_tickers, mode=mode)
+        self.print_write_summary(success_count, error_count, state)
         
         return success_count, error_count
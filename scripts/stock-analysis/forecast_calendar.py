@@ -0,0 +1,81 @@
+import threading
+import numpy as np
+import pandas as pd
+from config import FORECAST_FREQ
+from trading_calendar import TRADING_DAY
+
+
+def calendar_day(date):
+    """date as a tz-naive midnight Timestamp (tz-aware dates keep their local day)"""
+    day = pd.Timestamp(date)
+    if day.tz is not None:
+        day = day.tz_localize(None)
+    return day.normalize()
+
+
+class ForecastCalendar:
+    """Future date axes for forecasts, computed once per (last date, length) and shared.
+    
+    Nearly every ticker's history ends on the same trading day, so the
+    forecast axis after it (and its 'YYYY-MM-DD' labels) is built once per
+    run instead of once per ticker. freq decides which days the forecast
+    steps over: 'NYSE' (the default) for exchange trading sessions, or any
+    pandas offset alias or DateOffset, e.g. 'D' for every calendar day.
+    """
+    
+    def __init__(self, freq=None):
+        freq = freq if freq is not None else FORECAST_FREQ
+        self.freq = TRADING_DAY if freq == 'NYSE' else freq
+        self.lock = threading.Lock()
+        self.axes = {}
+        self.horizons = {}
+    
+    def steps(self, last_date, calendar_days):
+        """Number of forecast steps that fall within calendar_days after last_date"""
+        key = (calendar_day(last_date), int(calendar_days))
+        
+        with self.lock:
+            cached = self.horizons.get(key)
+        if cached is not None:
+            return cached
+        
+        one_day = pd.Timedelta(days=1)
+        count = len(pd.date_range(start=key[0] + one_day, end=key[0] + key[1] * one_day, freq=self.freq))
+        
+        with self.lock:
+            return self.horizons.setdefault(key, count)
+    
+    def axis(self, last_date, periods):
+        """Return (dates, labels) for the periods days after last_date.
+        
+        dates is a read-only datetime64[D] array and labels a tuple of ISO
+        date strings; both are shared between callers.
+        """
+        key = (calendar_day(last_date), int(periods))
+        
+        with self.lock:
+            cached = self.axes.get(key)
+        if cached is not None:
+            return cached
+        
+        index = pd.date_range(start=key[0], periods=key[1] + 1, freq=self.freq)
+        dates = index.values.astype('datetime64[D]')
+        # Drop last_date itself (the range only contains it if it falls on freq)
+        dates = dates[dates > np.datetime64(key[0].date())][:key[1]]
+        dates.setflags(write=False)
+        cached = (dates, tuple(np.datetime_as_string(dates, unit='D').tolist()))
+        
+        with self.lock:
+            return self.axes.setdefault(key, cached)
+    
+    def clear(self):
+        """Forget cached axes (e.g. after changing freq)"""
+        with self.lock:
+            self.axes.clear()
+            self.horizons.clear()
+
+
+# Process-wide calendar shared by all forecast writers
+default_calendar = ForecastCalendar()
+forecast_axis = default_calendar.axis
+forecast_steps = default_calendar.steps
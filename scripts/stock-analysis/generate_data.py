@@ -2,10 +2,15 @@ import json
 import os
 from datetime import datetime
 import pandas as pd
-from webscrape import get_top_101_stocks, get_stock_price_data
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from webscrape import (
+    get_top_101_stocks, get_stock_price_data, get_bulk_price_data, slice_price_data
+)
 from sentiment_analysis import SentimentAnalyzer
-from predict import predict_stock_trend, generate_shocking_predictions
-from config import MAX_STOCKS
+from predict import predict_stock_trends, make_rng, generate_shocking_predictions
+from results import PriceSeries, history_series, forecast_series
+from config import MAX_STOCKS, MAX_WORKERS, STREAM_BATCH_SIZE
+import metrics
 
 
 def export_stock_data_to_json(ticker, name, price_data, prediction_result, sentiment_data):
@@ -14,44 +19,8 @@ def export_stock_data_to_json(ticker, name, price_data, prediction_result, senti
         return None
     
     try:
-        # Convert price data to historical format
-        historical_data = [
-            {
-                'date': date.strftime('%Y-%m-%d'),
-                'price': float(price)
-            }
-            for date, price in price_data['Close'].items()
-        ]
-
-        # Format prediction data
-        prediction_dates = pd.date_range(
-            start=price_data.index[-1] + pd.Timedelta(days=1),
-            periods=len(prediction_result['predictions'])
-        )
-        
-        prediction_data = {
-            'data': [
-                {
-                    'date': date.strftime('%Y-%m-%d'),
-                    'price': float(price)
-                }
-                for date, price in zip(prediction_dates, prediction_result['predictions'])
-            ],
-            'upper_bound': [
-                {
-                    'date': date.strftime('%Y-%m-%d'),
-                    'price': float(price)
-                }
-                for date, price in zip(prediction_dates, prediction_result['upper_bound'])
-            ],
-            'lower_bound': [
-                {
-                    'date': date.strftime('%Y-%m-%d'),
-                    'price': float(price)
-                }
-                for date, price in zip(prediction_dates, prediction_result['lower_bound'])
-            ]
-        }
+        history = history_series(price_data)
+        forecast = forecast_series(price_data, prediction_result)
         
         # Create final stock data structure
         stock_data = {
@@ -62,13 +31,17 @@ def export_stock_data_to_json(ticker, name, price_data, prediction_result, senti
                 'category': sentiment_data['category'] if 'category' in sentiment_data else sentiment_data.get('sentiment_category', 'Neutral'),
                 'investment_score': float(sentiment_data['investment_score'])
             },
-            'historical_data': historical_data,
-            'prediction': prediction_data,
+            'historical_data': history.to_records(),
+            'prediction': {
+                'data': forecast.to_records('price'),
+                'upper_bound': forecast.to_records('upper_bound'),
+                'lower_bound': forecast.to_records('lower_bound')
+            },
             'last_updated': datetime.now().isoformat()
         }
         
         return stock_data
-        
+    
     except Exception as e:
         print(f"Error exporting data for {ticker}: {str(e)}")
         import traceback
@@ -179,10 +152,93 @@ def _generate_ranking_report(ranked_df):
     print("✓ Generated ranking report")
 
 
-def analyze_top_stocks(max_stocks=None):
-    """Main analysis pipeline for top stocks"""
+def analyze_single_stock(analyzer, ticker_data, bulk_prices, position, total):
+    """Run sentiment analysis and gather price history for one ticker.
+    
+    Returns (sentiment_result, price_data); sentiment_result is None on error.
+    """
+    ticker = ticker_data['ticker']
+    
+    try:
+        print(f"  [{position}/{total}] Processing {ticker}...")
+        
+        # Sentiment analysis
+        with metrics.span('ticker.sentiment', ticker=ticker):
+            sentiment_result = analyzer.analyze_ticker_sentiment(ticker_data)
+        
+        # Slice this ticker's 90 days (3 months) from the batched download,
+        # falling back to a single request if the batch missed it
+        with metrics.span('ticker.prices', ticker=ticker):
+            price_data = slice_price_data(bulk_prices, ticker)
+            if price_data is None:
+                price_data = get_stock_price_data(ticker, days=90)
+        
+        if price_data is not None and not price_data.empty:
+            print(f"    ✓ Got {len(price_data)} price data points")
+        else:
+            price_data = None
+        
+        return sentiment_result, price_data
+    
+    except Exception as e:
+        print(f"  ✗ Error processing {ticker}: {e}")
+        import traceback
+        traceback.print_exc()
+        return None, None
+
+
+def attach_prediction(sentiment_result, price_data, prediction_result):
+    """Store history and forecast on sentiment_result; return the shocking-prediction summary"""
+    ticker = sentiment_result['ticker']
+    
+    if price_data is None:
+        # No price data available - mark for filtering
+        print(f"    ⚠ No price data available for {ticker}")
+        sentiment_result['historical_data'] = PriceSeries.empty('price')
+        sentiment_result['prediction'] = PriceSeries.empty('price', 'upper_bound', 'lower_bound')
+        sentiment_result['price_change_pct'] = None  # Mark as missing
+        return None
+    
+    if not prediction_result:
+        # No predictions available - mark for filtering
+        print(f"    ⚠ No predictions generated for {ticker}")
+        sentiment_result['historical_data'] = PriceSeries.empty('price')
+        sentiment_result['prediction'] = PriceSeries.empty('price', 'upper_bound', 'lower_bound')
+        sentiment_result['price_change_pct'] = None  # Mark as missing
+        return None
+    
+    # Store history and forecast as array-backed series (dict rows are built at write time)
+    sentiment_result['historical_data'] = history_series(price_data)
+    sentiment_result['prediction'] = forecast_series(price_data, prediction_result)
+    sentiment_result['price_change_pct'] = prediction_result['price_change_pct']
+    sentiment_result['prediction_direction'] = prediction_result['prediction_direction']
+    
+    # Collect for shocking predictions
+    return {
+        'ticker': ticker,
+        'name': sentiment_result['name'],
+        'price_change_pct': prediction_result['price_change_pct'],
+        'prediction_direction': prediction_result['prediction_direction'],
+        'current_price': prediction_result['current_price'],
+        'predicted_price_30d': prediction_result['predicted_price_30d'],
+        'sentiment_score': sentiment_result['avg_sentiment'],
+        'investment_score': sentiment_result['investment_score']
+    }
+
+
+def analyze_top_stocks(max_stocks=None, max_workers=None, checkpoints=None, resume=False):
+    """Main analysis pipeline for top stocks.
+    
+    Tickers are forecast in micro-batches of STREAM_BATCH_SIZE as their
+    sentiment analysis finishes, and each forecast ticker is saved to
+    checkpoints (a CheckpointStore) if given, so an interrupted run loses at
+    most one batch. With resume=True tickers with a fresh checkpoint are not
+    analyzed again.
+    """
     if max_stocks is None:
         max_stocks = MAX_STOCKS
+    if max_workers is None:
+        max_workers = MAX_WORKERS
     
     print(f"\n{'='*60}")
     print(f"Starting Stock Analysis Pipeline")
@@ -190,128 +246,88 @@ def analyze_top_stocks(max_stocks=None):
     
     # Step 1: Get top stocks
     print("Step 1: Fetching top stocks...")
-    top_stocks = get_top_101_stocks()
+    with metrics.span('stage', stage='universe'):
+        top_stocks = get_top_101_stocks()
     
     if len(top_stocks) > max_stocks:
         top_stocks = top_stocks.head(max_stocks)
     
     print(f"✓ Retrieved {len(top_stocks)} stocks\n")
     
-    # Step 2: Analyze sentiment
-    print("Step 2: Analyzing sentiment...")
+    resumed = {}
+    if checkpoints is not None and resume:
+        resumed = checkpoints.load_fresh(top_stocks['ticker'])
+        if resumed:
+            print(f"↺ Resuming {len(resumed)} stocks from checkpoints\n")
+            top_stocks = top_stocks[~top_stocks['ticker'].isin(resumed)]
+    
+    # Step 2: Fetch price history for the whole universe in batches
+    print("Step 2: Fetching price history...")
+    with metrics.span('stage', stage='prices'):
+        bulk_prices = get_bulk_price_data(top_stocks['ticker'].tolist(), days=90)
+    priced_count = 0 if bulk_prices.empty else bulk_prices.columns.get_level_values(0).nunique()
+    print(f"✓ Retrieved price history for {priced_count} stocks\n")
+    
+    workers = max(1, min(max_workers, len(top_stocks) or 1))
+    
+    # Step 3: Analyze sentiment, forecasting (30 days ahead) each micro-batch as it fills
+    print(f"Step 3: Analyzing sentiment and generating predictions ({workers} workers)...")
     analyzer = SentimentAnalyzer()
-    sentiment_results = []
-    all_predictions_data = []
-    
-    for idx, row in top_stocks.iterrows():
-        try:
-            ticker_data = row.to_dict()
-            ticker = ticker_data['ticker']
-            
-            print(f"  [{idx+1}/{len(top_stocks)}] Processing {ticker}...")
-            
-            # Sentiment analysis
-            sentiment_result = analyzer.analyze_ticker_sentiment(ticker_data)
-            
-            # Get price data - explicitly request 90 days (3 months)
-            price_data = get_stock_price_data(ticker, days=90)
-            
-            if price_data is not None and not price_data.empty:
-                print(f"    ✓ Got {len(price_data)} price data points")
-                # Generate predictions - 30 days (1 month) into the future
-                prediction_result = predict_stock_trend(
-                    ticker,
-                    price_data,
-                    sentiment_result['avg_sentiment']
-                )
-                
-                if prediction_result:
-                    # Store historical and prediction data in sentiment_result
-                    # Convert historical prices to list of dicts
-                    historical_data = [
-                        {
-                            'date': date.strftime('%Y-%m-%d'),
-                            'price': float(price)
-                        }
-                        for date, price in price_data['Close'].items()
-                    ]
-                    
-                    # Format prediction data with dates
-                    prediction_dates = pd.date_range(
-                        start=price_data.index[-1] + pd.Timedelta(days=1),
-                        periods=len(prediction_result['predictions'])
-                    )
-                    
-                    prediction_data = {
-                        'data': [
-                            {
-                                'date': date.strftime('%Y-%m-%d'),
-                                'price': float(price)
-                            }
-                            for date, price in zip(prediction_dates, prediction_result['predictions'])
-                        ],
-                        'upper_bound': [
-                            {
-                                'date': date.strftime('%Y-%m-%d'),
-                                'price': float(price)
-                            }
-                            for date, price in zip(prediction_dates, prediction_result['upper_bound'])
-                        ],
-                        'lower_bound': [
-                            {
-                                'date': date.strftime('%Y-%m-%d'),
-                                'price': float(price)
-                            }
-                            for date, price in zip(prediction_dates, prediction_result['lower_bound'])
-                        ]
-                    }
-                    
-                    # Add to sentiment result
-                    sentiment_result['historical_data'] = historical_data
-                    sentiment_result['prediction'] = prediction_data
-                    sentiment_result['price_change_pct'] = prediction_result['price_change_pct']
-                    sentiment_result['prediction_direction'] = prediction_result['prediction_direction']
-                    
-                    # Collect for shocking predictions
-                    all_predictions_data.append({
-                        'ticker': ticker,
-                        'name': sentiment_result['name'],
-                        'price_change_pct': prediction_result['price_change_pct'],
-                        'prediction_direction': prediction_result['prediction_direction'],
-                        'current_price': prediction_result['current_price'],
-                        'predicted_price_30d': prediction_result['predicted_price_30d'],
-                        'sentiment_score': sentiment_result['avg_sentiment'],
-                        'investment_score': sentiment_result['investment_score']
-                    })
-                else:
-                    # No predictions available - mark for filtering
-                    print(f"    ⚠ No predictions generated for {ticker}")
-                    sentiment_result['historical_data'] = []
-                    sentiment_result['prediction'] = {'data': [], 'upper_bound': [], 'lower_bound': []}
-                    sentiment_result['price_change_pct'] = None  # Mark as missing
-            else:
-                # No price data available - mark for filtering
-                print(f"    ⚠ No price data available for {ticker}")
-                sentiment_result['historical_data'] = []
-                sentiment_result['prediction'] = {'data': [], 'upper_bound': [], 'lower_bound': []}
-                sentiment_result['price_change_pct'] = None  # Mark as missing
-            
-            sentiment_results.append(sentiment_result)
-        
-        except Exception as e:
-            print(f"  ✗ Error processing {ticker}: {e}")
-            import traceback
-            traceback.print_exc()
+    rng = make_rng()
+    finished = {}
+    
+    tickers_data = [row.to_dict() for _, row in top_stocks.iterrows()]
+    total = len(tickers_data)
+    
+    def forecast(batch):
+        with metrics.span('stage', stage='forecast'):
+            prediction_results = predict_stock_trends(
+                [(result['ticker'], price_data, result['avg_sentiment']) for _, result, price_data in batch],
+                rng=rng
+            )
+        for (position, sentiment_result, price_data), prediction_result in zip(batch, prediction_results):
+            prediction_summary = attach_prediction(sentiment_result, price_data, prediction_result)
+            finished[position] = (sentiment_result, prediction_summary)
+            if prediction_summary is not None and checkpoints is not None:
+                checkpoints.save(sentiment_result['ticker'], sentiment_result, prediction_summary)
+    
+    with metrics.span('stage', stage='sentiment'), ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(analyze_single_stock, analyzer, ticker_data, bulk_prices, position + 1, total): position
+            for position, ticker_data in enumerate(tickers_data)
+        }
+        batch = []
+        for future in as_completed(futures):
+            result, price_data = future.result()
+            if result is None:
+                continue
+            batch.append((futures[future], result, price_data))
+            if len(batch) >= STREAM_BATCH_SIZE:
+                forecast(batch)
+                batch = []
+        if batch:
+            forecast(batch)
+    
+    # Back in universe order, so ties rank the same way as before
+    sentiment_results = [finished[position][0] for position in sorted(finished)]
+    all_predictions_data = [
+        finished[position][1] for position in sorted(finished) if finished[position][1] is not None
+    ]
+    
+    for sentiment_result, prediction_summary in resumed.values():
+        sentiment_results.append(sentiment_result)
+        all_predictions_data.append(prediction_summary)
     
-    print(f"\n✓ Completed sentiment analysis\n")
+    print(f"✓ Generated predictions for {len(all_predictions_data)} stocks\n")
     
-    # Step 3: Rank stocks
-    print("Step 3: Ranking stocks...")
-    ranked_stocks = rank_stocks_by_investment_potential(sentiment_results)
+    # Step 4: Rank stocks
+    print("Step 4: Ranking stocks...")
+    with metrics.span('stage', stage='rank'):
+        ranked_stocks = rank_stocks_by_investment_potential(sentiment_results)
     print(f"✓ Ranked {len(ranked_stocks)} stocks\n")
     
-    # Step 4: Generate shocking predictions
-    print("Step 4: Generating shocking predictions...")
+    # Step 5: Generate shocking predictions
+    print("Step 5: Generating shocking predictions...")
     shocking_predictions = generate_shocking_predictions(all_predictions_data, top_n=5)
     print(f"✓ Identified {len(shocking_predictions['all_shocking'])} shocking predictions\n")
     
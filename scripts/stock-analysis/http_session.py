@@ -0,0 +1,101 @@
+import hashlib
+import json
+import threading
+from pathlib import Path
+import requests
+from requests.adapters import HTTPAdapter
+from config import CACHE_DIR, HTTP_POOL_MAXSIZE
+import rate_limit
+import metrics
+
+
+DEFAULT_HEADERS = {
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Accept-Encoding': 'gzip, deflate',
+    'Connection': 'keep-alive',
+}
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(host):
+    """Return the pooled keep-alive session for a host key.
+    
+    Each host gets its own connection pool capped at HTTP_POOL_MAXSIZE;
+    extra threads wait for a free connection instead of opening new ones.
+    """
+    with _sessions_lock:
+        if host not in _sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_MAXSIZE, pool_block=True)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update(DEFAULT_HEADERS)
+            _sessions[host] = session
+        return _sessions[host]
+
+
+def _validator_path(url):
+    return Path(CACHE_DIR) / 'http' / f"{hashlib.sha1(url.encode()).hexdigest()}.json"
+
+
+def _load_validated(url):
+    try:
+        with open(_validator_path(url)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_validated(url, response):
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if not etag and not last_modified:
+        return
+    
+    path = _validator_path(url)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump({'etag': etag, 'last_modified': last_modified, 'body': response.text}, f)
+    tmp_path.replace(path)
+
+
+def fetch_text(url, host, headers=None, timeout=15, revalidate=False):
+    """GET url through the host's session and rate limiter and return the body.
+    
+    With revalidate=True the last body is kept on disk together with its
+    ETag/Last-Modified validators, and an unchanged page comes back as a
+    cheap 304. Raises requests.HTTPError for error statuses.
+    """
+    request_headers = dict(headers or {})
+    cached = _load_validated(url) if revalidate else None
+    
+    if cached:
+        if cached.get('etag'):
+            request_headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            request_headers['If-Modified-Since'] = cached['last_modified']
+    
+    rate_limit.acquire(host)
+    with metrics.span('http.request', host=host):
+        response = get_session(host).get(url, headers=request_headers, timeout=timeout)
+    rate_limit.report(host, response.status_code, response.headers.get('Retry-After'))
+    metrics.incr('http.requests', host=host, status=response.status_code)
+    metrics.incr('http.bytes', len(response.content), host=host)
+    
+    if response.status_code == 304 and cached:
+        metrics.incr('cache.hits', cache='http')
+        return cached['body']
+    
+    response.raise_for_status()
+    
+    if revalidate:
+        try:
+            _save_validated(url, response)
+        except OSError as e:
+            print(f"    ⚠ Could not cache response for {url}: {e}")
+    
+    return response.text
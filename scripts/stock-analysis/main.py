@@ -4,6 +4,7 @@ Main entry point for stock analysis pipeline
 Runs complete analysis and writes to database
 """
 
+import argparse
 import sys
 import os
 from datetime import datetime
@@ -21,32 +22,81 @@ if repo_root not in sys.path:
     sys.path.insert(0, repo_root)
 
 from generate_data import analyze_top_stocks
+from pipeline import run_streaming_pipeline
 from database import DatabaseManager
-from config import MAX_STOCKS
+from cache import CheckpointStore
+from config import MAX_STOCKS, PIPELINE_MODE, METRICS_REPORT_PATH
+import metrics
 
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the stock analysis pipeline and update the database")
+    parser.add_argument(
+        '--resume', action='store_true',
+        help="skip tickers already analyzed by an interrupted run (see CHECKPOINT_TTL_HOURS)"
+    )
+    parser.add_argument(
+        '--metrics-report', default=METRICS_REPORT_PATH,
+        help="where to write the run report (.json, or .prom for a Prometheus textfile); '' disables"
+    )
+    return parser.parse_args(argv)
+
+
+def write_metrics_report(path):
+    """Write the run's timings and counters; never fails the run"""
+    if not path:
+        return
+    try:
+        written = metrics.metrics.write_report(path)
+        print(f"Run report written to {written}")
+    except OSError as e:
+        print(f"⚠ Could not write run report: {e}")
+
+
+def main(argv=None):
     """Run the complete stock analysis pipeline"""
+    args = parse_args(argv)
+    metrics.metrics.reset()
+    db = None
+    
     try:
         print("\n" + "="*70)
         print(f"STOCK ANALYSIS PIPELINE")
         print(f"Started at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         print("="*70 + "\n")
         
-        # Step 1: Run analysis
-        print("Phase 1: Analyzing stocks...")
-        ranked_stocks, shocking_predictions = analyze_top_stocks(max_stocks=MAX_STOCKS)
-        
-        if ranked_stocks.empty:
-            print("✗ No stocks were successfully analyzed. Exiting.")
-            sys.exit(1)
-        
-        print(f"\n✓ Successfully analyzed {len(ranked_stocks)} stocks")
-        
-        # Step 2: Write to database
-        print("\nPhase 2: Updating database...")
         db = DatabaseManager()
-        success_count, error_count = db.write_analysis_to_database(ranked_stocks, shocking_predictions)
+        
+        checkpoints = CheckpointStore()
+        if not args.resume:
+            checkpoints.clear()
+        
+        if PIPELINE_MODE == 'streaming':
+            # Each ticker is written as soon as it has been analyzed
+            print("Streaming analysis and database writes...")
+            ranked_stocks, shocking_predictions, success_count, error_count = run_streaming_pipeline(
+                db, max_stocks=MAX_STOCKS, checkpoints=checkpoints, resume=args.resume
+            )
+            
+            if ranked_stocks.empty:
+                print("✗ No stocks were successfully analyzed. Exiting.")
+                sys.exit(1)
+        else:
+            # Step 1: Run analysis
+            print("Phase 1: Analyzing stocks...")
+            ranked_stocks, shocking_predictions = analyze_top_stocks(
+                max_stocks=MAX_STOCKS, checkpoints=checkpoints, resume=args.resume
+            )
+            
+            if ranked_stocks.empty:
+                print("✗ No stocks were successfully analyzed. Exiting.")
+                sys.exit(1)
+            
+            print(f"\n✓ Successfully analyzed {len(ranked_stocks)} stocks")
+            
+            # Step 2: Write to database
+            print("\nPhase 2: Updating database...")
+            success_count, error_count = db.write_analysis_to_database(ranked_stocks, shocking_predictions)
         
         # Step 3: Summary
         print("\n" + "="*70)
@@ -70,55 +120,15 @@ def main():
         print(f"\nCompleted at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         print("="*70 + "\n")
         
-        # Exit with appropriate code
-        sys.exit(0 if error_count == 0 else 1)
-        print(f"STOCK ANALYSIS PIPELINE")
-        print(f"Started at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        print("="*70 + "\n")
-        
-        # Step 1: Run analysis
-        print("Phase 1: Analyzing stocks...")
-        ranked_stocks, shocking_predictions = analyze_top_stocks(max_stocks=MAX_STOCKS)
-        
-        if ranked_stocks.empty:
-            print("✗ No stocks were successfully analyzed. Exiting.")
-            sys.exit(1)
-        
-        print(f"\n✓ Successfully analyzed {len(ranked_stocks)} stocks")
-        
-        # Step 2: Write to database
-        print("\nPhase 2: Writing to database...")
-        db = DatabaseManager()
-        success_count, error_count = db.write_analysis_to_database(
-            ranked_stocks,
-            shocking_predictions
-        )
-        
-        # Step 3: Summary
-        print("\n" + "="*70)
-        print("PIPELINE SUMMARY")
-        print("="*70)
-        print(f"Stocks analyzed: {len(ranked_stocks)}")
-        print(f"Database writes successful: {success_count}")
-        print(f"Database writes failed: {error_count}")
-        print(f"Top investment: {ranked_stocks.iloc[0]['ticker']} (Score: {ranked_stocks.iloc[0]['investment_score']:.2f})")
-        
-        if shocking_predictions['top_increases']:
-            top_increase = shocking_predictions['top_increases'][0]
-            print(f"Biggest predicted increase: {top_increase['symbol']} (+{top_increase['prediction']:.2f}%)")
-        
-        if shocking_predictions['top_decreases']:
-            top_decrease = shocking_predictions['top_decreases'][0]
-            print(f"Biggest predicted decrease: {top_decrease['symbol']} (-{top_decrease['prediction']:.2f}%)")
-        
-        print(f"\nCompleted at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        print("="*70 + "\n")
+        # A clean run needs no resume; keep checkpoints after failures so --resume can use them
+        if error_count == 0:
+            checkpoints.clear()
         
         # Exit with appropriate code
         sys.exit(0 if error_count == 0 else 1)
     
     except KeyboardInterrupt:
-        print("\n\n⚠ Pipeline interrupted by user")
+        print("\n\n⚠ Pipeline interrupted by user (rerun with --resume to continue)")
         sys.exit(130)
     
     except Exception as e:
@@ -130,6 +140,11 @@ def main():
         traceback.print_exc()
         print("="*70 + "\n")
         sys.exit(1)
+    
+    finally:
+        if db is not None:
+            db.close()
+        write_metrics_report(args.metrics_report)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,154 @@
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    """Thread-safe run instrumentation: timed spans, counters and per-ticker timings.
+    
+    Spans and counters are keyed by name plus optional labels (e.g. host or
+    table). Spans tagged with a ticker are also accumulated per ticker; those
+    appear in the JSON report only, to keep Prometheus label cardinality low.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        with self.lock:
+            self.started_at = datetime.now()
+            self.spans = {}
+            self.counters = {}
+            self.tickers = {}
+    
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted((key, str(value)) for key, value in labels.items())))
+    
+    def observe(self, name, seconds, ticker=None, **labels):
+        """Record one completed span of the given duration"""
+        key = self._key(name, labels)
+        with self.lock:
+            entry = self.spans.setdefault(key, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            entry['count'] += 1
+            entry['seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], seconds)
+            if ticker is not None:
+                per_ticker = self.tickers.setdefault(ticker, {})
+                per_ticker[name] = per_ticker.get(name, 0.0) + seconds
+    
+    @contextmanager
+    def span(self, name, ticker=None, **labels):
+        """Time the enclosed block (recorded even if it raises)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, ticker=ticker, **labels)
+    
+    def timed(self, name, **labels):
+        """Decorator form of span() for whole functions"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name, **labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+    
+    def incr(self, name, value=1, **labels):
+        """Add value to a counter"""
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+    
+    def report(self):
+        """Return the run report as a JSON-serializable dict"""
+        with self.lock:
+            finished_at = datetime.now()
+            return {
+                'started_at': self.started_at.isoformat(),
+                'finished_at': finished_at.isoformat(),
+                'duration_seconds': round((finished_at - self.started_at).total_seconds(), 3),
+                'spans': [
+                    {'name': name, 'labels': dict(labels), 'count': entry['count'],
+                     'seconds': round(entry['seconds'], 6), 'max_seconds': round(entry['max_seconds'], 6)}
+                    for (name, labels), entry in sorted(self.spans.items())
+                ],
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                'tickers': {
+                    ticker: {name: round(seconds, 6) for name, seconds in sorted(spans.items())}
+                    for ticker, spans in sorted(self.tickers.items())
+                },
+            }
+    
+    def to_prometheus(self, prefix='stock_pipeline'):
+        """Render spans and counters in the Prometheus text exposition format"""
+        report = self.report()
+        
+        def series(name, labels):
+            if not labels:
+                return name
+            rendered = ','.join(f'{key}="{_escape_label(value)}"' for key, value in labels.items())
+            return f'{name}{{{rendered}}}'
+        
+        def metric_name(name):
+            return f"{prefix}_{''.join(c if c.isalnum() else '_' for c in name)}"
+        
+        lines = [
+            f'# TYPE {prefix}_duration_seconds gauge',
+            f'{prefix}_duration_seconds {report["duration_seconds"]}',
+        ]
+        
+        # Samples of one metric family must be contiguous
+        for family, field, kind in (('span_seconds_total', 'seconds', 'counter'),
+                                    ('span_count_total', 'count', 'counter'),
+                                    ('span_max_seconds', 'max_seconds', 'gauge')):
+            lines.append(f'# TYPE {prefix}_{family} {kind}')
+            for entry in report['spans']:
+                labels = {'span': entry['name'], **entry['labels']}
+                lines.append(f"{series(f'{prefix}_{family}', labels)} {entry[field]}")
+        
+        typed = set()
+        for entry in report['counters']:
+            name = f"{metric_name(entry['name'])}_total"
+            if name not in typed:
+                lines.append(f'# TYPE {name} counter')
+                typed.add(name)
+            lines.append(f"{series(name, entry['labels'])} {entry['value']}")
+        
+        return '\n'.join(lines) + '\n'
+    
+    def write_report(self, path):
+        """Write the report to path: Prometheus textfile for .prom, JSON otherwise"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.suffix == '.prom':
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.report(), indent=2)
+        
+        tmp_path = path.with_suffix(path.suffix + '.tmp')
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        tmp_path.replace(path)
+        return path
+
+
+# Process-wide instance used by all pipeline modules
+metrics = Metrics()
+span = metrics.span
+timed = metrics.timed
+incr = metrics.incr
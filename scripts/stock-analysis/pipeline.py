@@ -0,0 +1,316 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from webscrape import get_top_101_stocks, get_bulk_price_data
+from sentiment_analysis import SentimentAnalyzer
+from predict import predict_stock_trends, make_rng, generate_shocking_predictions
+from generate_data import analyze_single_stock, attach_prediction, rank_stocks_by_investment_potential
+from database import WriteResult
+import metrics
+from config import (
+    MAX_STOCKS, MAX_WORKERS, PRICE_BATCH_SIZE, STREAM_BATCH_SIZE, STREAM_QUEUE_SIZE,
+    STREAM_LINGER_SECONDS, DB_WRITE_MODE
+)
+
+
+_DONE = object()
+
+# How often blocked queue calls wake up to check for cancellation
+_POLL_SECONDS = 0.1
+
+# Bulky per-ticker fields dropped once a ticker has been written
+_DETAIL_FIELDS = ('historical_data', 'prediction', 'news_details', 'provisional_rank')
+
+
+def _run_stage(target, errors, cancel, *args):
+    """Start target in a daemon thread; an exception is recorded in errors and cancels the pipeline"""
+    def run():
+        try:
+            target(*args)
+        except BaseException as e:
+            errors.append(e)
+            cancel.set()
+    
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def _put(out_queue, item, cancel):
+    """Put item, giving up if the pipeline is cancelled; returns whether it was queued"""
+    while not cancel.is_set():
+        try:
+            out_queue.put(item, timeout=_POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(in_queue, cancel, timeout=None):
+    """Get the next item, or _DONE once the pipeline is cancelled.
+    
+    With a timeout, raises queue.Empty if nothing arrived in time.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while not cancel.is_set():
+        wait = _POLL_SECONDS if deadline is None else min(_POLL_SECONDS, deadline - time.monotonic())
+        if wait <= 0:
+            raise queue.Empty
+        try:
+            return in_queue.get(timeout=wait)
+        except queue.Empty:
+            pass
+    return _DONE
+
+
+def _drain(in_queue, batch_size, cancel, linger=None):
+    """Block for one item, then keep collecting until batch_size items or linger seconds pass.
+    
+    Returns (items, done); done is True once the upstream sentinel was seen
+    or the pipeline was cancelled.
+    """
+    if linger is None:
+        linger = STREAM_LINGER_SECONDS
+    
+    item = _get(in_queue, cancel)
+    if item is _DONE:
+        return [], True
+    
+    items = [item]
+    deadline = time.monotonic() + linger
+    while len(items) < batch_size:
+        try:
+            item = _get(in_queue, cancel, timeout=max(0.0, deadline - time.monotonic()))
+        except queue.Empty:
+            break
+        if item is _DONE:
+            return items, True
+        items.append(item)
+    
+    return items, False
+
+
+def _fetch_stage(tickers_data, price_queue, cancel):
+    """Download price history one PRICE_BATCH_SIZE batch at a time"""
+    try:
+        for i in range(0, len(tickers_data), PRICE_BATCH_SIZE):
+            batch = tickers_data[i:i + PRICE_BATCH_SIZE]
+            with metrics.span('stage', stage='prices'):
+                bulk_prices = get_bulk_price_data([item['ticker'] for _, item in batch], days=90)
+            if not _put(price_queue, (batch, bulk_prices), cancel):
+                break
+    finally:
+        _put(price_queue, _DONE, cancel)
+
+
+def _sentiment_stage(analyzer, price_queue, scored_queue, workers, total, cancel):
+    """Score each ticker as soon as its price batch has arrived"""
+    def score(position, ticker_data, bulk_prices):
+        if cancel.is_set():
+            return
+        result, price_data = analyze_single_stock(analyzer, ticker_data, bulk_prices, position + 1, total)
+        if result is not None:
+            result['provisional_rank'] = position + 1
+            _put(scored_queue, (result, price_data), cancel)
+    
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            while True:
+                item = _get(price_queue, cancel)
+                if item is _DONE:
+                    break
+                batch, bulk_prices = item
+                futures.extend(
+                    executor.submit(score, position, ticker_data, bulk_prices)
+                    for position, ticker_data in batch
+                )
+            for future in futures:
+                future.result()
+    finally:
+        _put(scored_queue, _DONE, cancel)
+
+
+def _write_stage(db, write_queue, mode, written, summaries, known_tickers, cancel):
+    """Write prices and predictions in micro-batches, then keep only the ticker's summary fields.
+    
+    Tickers already in the stocks table keep their row (and rank) until the
+    final ranked upsert. New tickers get a row with their universe position
+    as a provisional rank first, since their prices and predictions
+    reference it. known_tickers is the stocks table's tickers, or None if
+    unknown (every ticker is then treated as new).
+    """
+    done = False
+    while not done:
+        batch, done = _drain(write_queue, STREAM_BATCH_SIZE, cancel)
+        if not batch:
+            continue
+        
+        try:
+            stocks_data = [db.stock_data_from_row(result, result['provisional_rank']) for result in batch]
+            with metrics.span('stage', stage='write'):
+                new_stocks = [
+                    stock_data for stock_data in stocks_data
+                    if known_tickers is None or stock_data['ticker'] not in known_tickers
+                ]
+                if new_stocks:
+                    added = db.add_stock_rows(new_stocks)
+                    failed = {ticker for ticker, ok in added.items() if not ok}
+                    written.update({ticker: False for ticker in failed})
+                    stocks_data = [stock_data for stock_data in stocks_data if stock_data['ticker'] not in failed]
+                    if known_tickers is not None:
+                        known_tickers.update(added.keys() - failed)
+                written.update(db.write_stocks(stocks_data, mode=mode, stock_rows=False))
+        except Exception as e:
+            # Keep draining so upstream stages never block on a full queue
+            print(f"  ✗ Could not write batch of {len(batch)} stocks: {e}")
+            written.update({result['ticker']: False for result in batch})
+        
+        for result in batch:
+            summaries.append({key: value for key, value in result.items() if key not in _DETAIL_FIELDS})
+
+
+def run_streaming_pipeline(db, max_stocks=None, max_workers=None, mode=None, checkpoints=None, resume=False):
+    """Analyze and persist the top stocks with each ticker written as soon as it is ready.
+    
+    Stages run concurrently and hand off through bounded queues:
+    price batches -> sentiment (thread pool) -> forecast (micro-batches of
+    STREAM_BATCH_SIZE) -> database writes. Only summary fields are kept
+    once a ticker is written, so memory stays flat as MAX_STOCKS grows.
+    
+    Prices and predictions are written as tickers finish (in batches of
+    up to STREAM_BATCH_SIZE, waiting at most STREAM_LINGER_SECONDS to fill
+    one), after a provisional stocks row for tickers new to the table; once
+    all are in, the stocks rows are upserted with their final ranks and
+    stocks that dropped out of the analysis are removed.
+    If any stage fails, the others are cancelled and the error is raised.
+    
+    Every forecast ticker is saved to checkpoints (a CheckpointStore) if
+    given; with resume=True tickers that have a fresh checkpoint skip
+    fetching, scoring and forecasting and go straight to the writer.
+    
+    Returns (ranked_stocks, shocking_predictions, success_count, error_count).
+    ranked_stocks holds the summary columns only (no histories/forecasts).
+    """
+    if max_stocks is None:
+        max_stocks = MAX_STOCKS
+    if max_workers is None:
+        max_workers = MAX_WORKERS
+    if mode is None:
+        mode = DB_WRITE_MODE
+    
+    print(f"\n{'='*60}")
+    print(f"Starting Streaming Stock Analysis Pipeline")
+    print(f"{'='*60}\n")
+    
+    print("Step 1: Fetching top stocks...")
+    with metrics.span('stage', stage='universe'):
+        top_stocks = get_top_101_stocks()
+    if len(top_stocks) > max_stocks:
+        top_stocks = top_stocks.head(max_stocks)
+    print(f"✓ Retrieved {len(top_stocks)} stocks\n")
+    
+    tickers_data = list(enumerate(row.to_dict() for _, row in top_stocks.iterrows()))
+    all_predictions_data = []
+    
+    resumed = {}
+    if checkpoints is not None and resume:
+        resumed = checkpoints.load_fresh(top_stocks['ticker'])
+        if resumed:
+            print(f"↺ Resuming {len(resumed)} stocks from checkpoints\n")
+    
+    resumed_results = []
+    for position, ticker_data in tickers_data:
+        if ticker_data['ticker'] in resumed:
+            result, prediction_summary = resumed[ticker_data['ticker']]
+            result['provisional_rank'] = position + 1
+            resumed_results.append(result)
+            all_predictions_data.append(prediction_summary)
+    tickers_data = [item for item in tickers_data if item[1]['ticker'] not in resumed]
+    total = len(tickers_data)
+    workers = max(1, min(max_workers, total or 1))
+    
+    print(f"Step 2: Fetching, scoring, forecasting and writing ({workers} workers)...")
+    price_queue = queue.Queue(maxsize=1)  # Prefetch one price batch ahead of scoring
+    scored_queue = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    write_queue = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    cancel = threading.Event()
+    errors = []
+    written = {}
+    summaries = []
+    
+    db.last_write_result = WriteResult() if mode == 'per_ticker' else None
+    known_tickers = db.stock_tickers()
+    
+    stages = [
+        _run_stage(_fetch_stage, errors, cancel, tickers_data, price_queue, cancel),
+        _run_stage(_sentiment_stage, errors, cancel, SentimentAnalyzer(), price_queue, scored_queue, workers, total, cancel),
+        _run_stage(_write_stage, errors, cancel, db, write_queue, mode, written, summaries, known_tickers, cancel),
+    ]
+    
+    # Forecast on this thread: whatever has been scored so far goes through
+    # one vectorized predict_stock_trends call
+    rng = make_rng()
+    try:
+        for result in resumed_results:
+            _put(write_queue, result, cancel)
+        
+        done = False
+        while not done:
+            analyzed, done = _drain(scored_queue, STREAM_BATCH_SIZE, cancel)
+            if not analyzed:
+                continue
+            
+            with metrics.span('stage', stage='forecast'):
+                prediction_results = predict_stock_trends(
+                    [(result['ticker'], price_data, result['avg_sentiment']) for result, price_data in analyzed],
+                    rng=rng
+                )
+            
+            for (sentiment_result, price_data), prediction_result in zip(analyzed, prediction_results):
+                prediction_summary = attach_prediction(sentiment_result, price_data, prediction_result)
+                if prediction_summary is None:
+                    continue
+                all_predictions_data.append(prediction_summary)
+                if checkpoints is not None:
+                    checkpoints.save(sentiment_result['ticker'], sentiment_result, prediction_summary)
+                _put(write_queue, sentiment_result, cancel)
+    except BaseException:
+        cancel.set()
+        raise
+    finally:
+        _put(write_queue, _DONE, cancel)
+        for stage in stages:
+            stage.join()
+    
+    if errors:
+        raise errors[0]
+    
+    print(f"\n✓ Streamed {len(summaries)} stocks to the database\n")
+    
+    print("Step 3: Ranking stocks and publishing ranks...")
+    with metrics.span('stage', stage='rank'):
+        ranked_stocks = rank_stocks_by_investment_potential(summaries)
+    new_tickers = set(ranked_stocks['ticker']) if not ranked_stocks.empty else set()
+    existing_tickers = db.remove_stale_stocks(new_tickers)
+    
+    stocks_data = [
+        db.stock_data_from_row(stock, rank)
+        for rank, (_, stock) in enumerate(ranked_stocks.iterrows(), start=1)
+    ]
+    ranked = db.upsert_stock_rows(stocks_data)
+    success_count = sum(1 for ticker, ok in written.items() if ok and ranked.get(ticker))
+    error_count = len(written) - success_count
+    print(f"✓ Ranked {len(ranked_stocks)} stocks\n")
+    
+    print("Step 4: Generating shocking predictions...")
+    shocking_predictions = generate_shocking_predictions(all_predictions_data, top_n=5)
+    print(f"✓ Identified {len(shocking_predictions['all_shocking'])} shocking predictions\n")
+    
+    upserted = {ticker for ticker, ok in ranked.items() if ok}
+    state = db.finish_write(upserted, existing_tickers, mode=mode)
+    db.print_write_summary(success_count, error_count, state)
+    
+    return ranked_stocks, shocking_predictions, success_count, error_count
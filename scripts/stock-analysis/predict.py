@@ -1,86 +1,201 @@
-import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
-from config import PREDICTION_DAYS
-from webscrape import get_stock_price_data
+from datetime import datetime
+from config import (
+    PREDICTION_DAYS, FORECAST_SEED, FORECAST_MODE, ENSEMBLE_PATHS,
+    ENSEMBLE_LOWER_PCT, ENSEMBLE_UPPER_PCT, ENSEMBLE_CHUNK_ELEMENTS
+)
+from forecast_calendar import calendar_day, forecast_steps
 
 
-def predict_stock_trend(ticker, price_data, sentiment_score):
-    """Generate price predictions based on historical prices and sentiment"""
+def make_rng(seed=None):
+    """Return the forecast random generator (seeded from FORECAST_SEED if set)"""
+    return np.random.default_rng(FORECAST_SEED if seed is None else seed)
+
+
+def forecast_inputs(price_data, sentiment_score):
+    """Compute (last_close, daily_drift, volatility) for one ticker, or None"""
     if price_data is None or len(price_data) < 5:
         return None
     
-    try:
-        # Get the last closing price
-        last_close = price_data['Close'].iloc[-1]
-        
-        # Calculate moving averages
-        short_window = min(10, len(price_data))
-        long_window = min(30, len(price_data))
-        
-        short_ma = price_data['Close'].rolling(window=short_window).mean().iloc[-1]
-        long_ma = price_data['Close'].rolling(window=long_window).mean().iloc[-1]
-        
-        # Calculate average daily price change
-        avg_daily_change = price_data['Close'].pct_change().mean()
-        volatility = price_data['Close'].pct_change().std()
-        
-        # Convert sentiment to a price adjustment factor
-        sentiment_factor = 1 + (sentiment_score * 0.05)
-        
-        # Calculate momentum
-        momentum = (short_ma / long_ma - 1) if long_ma > 0 else 0
-        
-        # Generate predictions
+    close = price_data['Close']
+    
+    # Get the last closing price
+    last_close = float(close.iloc[-1])
+    
+    # Calculate moving averages (last value of the rolling means)
+    short_window = min(10, len(close))
+    long_window = min(30, len(close))
+    
+    short_ma = close.iloc[-short_window:].mean()
+    long_ma = close.iloc[-long_window:].mean()
+    
+    # Calculate average daily price change
+    returns = close.pct_change()
+    avg_daily_change = returns.mean()
+    volatility = returns.std()
+    
+    # Convert sentiment to a price adjustment factor
+    sentiment_factor = 1 + (sentiment_score * 0.05)
+    
+    # Calculate momentum
+    momentum = (short_ma / long_ma - 1) if long_ma > 0 else 0
+    
+    # Blend of momentum, average change, and sentiment
+    daily_drift = (avg_daily_change + momentum / 30) * sentiment_factor
+    
+    return last_close, float(daily_drift), float(volatility)
+
+
+def forecast_paths(last_close, daily_drift, volatility, prediction_days=None, rng=None):
+    """Generate prediction, upper and lower bound paths for many tickers at once.
+    
+    Inputs are arrays of shape (n_tickers,); each output is an
+    (n_tickers, prediction_days) matrix whose first column is the last close.
+    Each step applies the drift and volatility-scaled noise, floored at a 5%
+    daily drop, so a path is the cumulative product of its step factors.
+    """
+    if prediction_days is None:
         prediction_days = PREDICTION_DAYS
-        dates = pd.date_range(
-            start=price_data.index[-1] + pd.Timedelta(days=1), 
-            periods=prediction_days
-        )
-        
-        predicted_prices = [last_close]
-        upper_bounds = [last_close]
-        lower_bounds = [last_close]
-        
-        for i in range(1, prediction_days):
-            # Blend of momentum, average change, and sentiment
-            daily_change = (avg_daily_change + momentum/30) * sentiment_factor
-            
-            # Calculate next price
-            next_price = predicted_prices[-1] * (1 + daily_change)
-            
-            # Add realistic noise based on historical volatility
-            noise = np.random.normal(0, volatility * 0.5)
-            next_price = next_price * (1 + noise)
-            
-            # Ensure price stays positive
-            next_price = max(next_price, predicted_prices[-1] * 0.95)
-            
-            # Calculate confidence bounds
-            confidence_interval = volatility * 1.96  # 95% confidence
-            upper_bound = next_price * (1 + confidence_interval)
-            lower_bound = next_price * (1 - confidence_interval)
-            
-            predicted_prices.append(next_price)
-            upper_bounds.append(upper_bound)
-            lower_bounds.append(lower_bound)
+    if rng is None:
+        rng = make_rng()
+    
+    last_close = np.asarray(last_close, dtype=np.float64).reshape(-1)
+    daily_drift = np.asarray(daily_drift, dtype=np.float64).reshape(-1, 1)
+    volatility = np.asarray(volatility, dtype=np.float64).reshape(-1, 1)
+    
+    # Add realistic noise based on historical volatility
+    noise = rng.standard_normal((len(last_close), prediction_days - 1)) * (volatility * 0.5)
+    step_factors = np.maximum((1 + daily_drift) * (1 + noise), 0.95)
+    
+    predictions = np.empty((len(last_close), prediction_days))
+    predictions[:, 0] = last_close
+    np.cumprod(step_factors, axis=1, out=predictions[:, 1:])
+    predictions[:, 1:] *= last_close[:, None]
+    
+    # 95% confidence bounds around each predicted point
+    confidence_interval = volatility * 1.96
+    upper_bounds = predictions * (1 + confidence_interval)
+    lower_bounds = predictions * (1 - confidence_interval)
+    upper_bounds[:, 0] = last_close
+    lower_bounds[:, 0] = last_close
+    
+    return predictions, upper_bounds, lower_bounds
+
+
+def simulate_ensemble(last_close, daily_drift, volatility, prediction_days=None,
+                      n_paths=None, quantiles=None, rng=None, max_chunk_elements=None):
+    """Simulate n_paths per ticker and return empirical quantile paths.
+    
+    Uses the same step model as forecast_paths(). Returns an array of shape
+    (len(quantiles), n_tickers, prediction_days) with quantiles given in
+    percent. Tickers are simulated in chunks of at most max_chunk_elements
+    prices, so memory stays bounded however many tickers or paths are used.
+    """
+    if prediction_days is None:
+        prediction_days = PREDICTION_DAYS
+    if n_paths is None:
+        n_paths = ENSEMBLE_PATHS
+    if quantiles is None:
+        quantiles = (ENSEMBLE_LOWER_PCT, 50, ENSEMBLE_UPPER_PCT)
+    if rng is None:
+        rng = make_rng()
+    if max_chunk_elements is None:
+        max_chunk_elements = ENSEMBLE_CHUNK_ELEMENTS
+    
+    last_close = np.asarray(last_close, dtype=np.float64).reshape(-1)
+    daily_drift = np.asarray(daily_drift, dtype=np.float64).reshape(-1, 1, 1)
+    volatility = np.asarray(volatility, dtype=np.float64).reshape(-1, 1, 1)
+    probabilities = np.asarray(quantiles, dtype=np.float64) / 100
+    
+    steps = prediction_days - 1
+    result = np.empty((len(probabilities), len(last_close), prediction_days))
+    result[:, :, 0] = last_close
+    
+    tickers_per_chunk = max(1, max_chunk_elements // max(1, n_paths * steps))
+    
+    for start in range(0, len(last_close), tickers_per_chunk):
+        chunk = slice(start, start + tickers_per_chunk)
+        count = len(last_close[chunk])
         
-        # Calculate prediction metrics
-        price_change_pct = ((predicted_prices[-1] - last_close) / last_close) * 100
+        # Build step factors in place to avoid extra full-size temporaries
+        paths = rng.standard_normal((count, n_paths, steps))
+        paths *= volatility[chunk] * 0.5
+        paths += 1
+        paths *= 1 + daily_drift[chunk]
+        np.maximum(paths, 0.95, out=paths)
+        np.cumprod(paths, axis=2, out=paths)
         
-        return {
-            'predictions': predicted_prices,
-            'upper_bound': upper_bounds,
-            'lower_bound': lower_bounds,
-            'current_price': round(last_close, 2),
-            'predicted_price_30d': round(predicted_prices[-1], 2),
-            'price_change_pct': round(price_change_pct, 2),
-            'prediction_direction': 'increase' if price_change_pct > 0 else 'decrease'
+        result[:, chunk, 1:] = np.quantile(paths, probabilities, axis=1) * last_close[chunk, None]
+    
+    return result
+
+
+def predict_stock_trends(items, rng=None, mode=None, prediction_days=None):
+    """Forecast many tickers in one vectorized pass.
+    
+    items is a list of (ticker, price_data, sentiment_score). Returns a
+    list of per-ticker result dicts (or None) in the same order; their paths
+    are row views of the shared forecast matrices. In 'ensemble' mode the
+    prediction is the median simulated path and the bounds are the
+    ENSEMBLE_LOWER_PCT/ENSEMBLE_UPPER_PCT quantiles.
+    
+    By default the paths have one point per forecast-calendar step (trading
+    session) in the PREDICTION_DAYS calendar days after the latest bar.
+    """
+    if mode is None:
+        mode = FORECAST_MODE
+    
+    results = [None] * len(items)
+    valid = []
+    last_dates = []
+    
+    for idx, (ticker, price_data, sentiment_score) in enumerate(items):
+        try:
+            inputs = forecast_inputs(price_data, sentiment_score)
+            if inputs is not None and np.isfinite(inputs).all():
+                valid.append((idx, inputs))
+                # Histories may mix tz-naive (download/cache) and tz-aware (Ticker.history) indexes
+                last_dates.append(calendar_day(price_data.index[-1]))
+        except Exception as e:
+            print(f"Error generating prediction for {ticker}: {e}")
+    
+    if not valid:
+        return results
+    
+    if prediction_days is None:
+        prediction_days = max(2, forecast_steps(max(last_dates), PREDICTION_DAYS))
+    
+    last_close, daily_drift, volatility = (np.array(column) for column in zip(*(inputs for _, inputs in valid)))
+    if mode == 'ensemble':
+        lower_bounds, predictions, upper_bounds = simulate_ensemble(
+            last_close, daily_drift, volatility, prediction_days=prediction_days, rng=rng
+        )
+    else:
+        predictions, upper_bounds, lower_bounds = forecast_paths(
+            last_close, daily_drift, volatility, prediction_days=prediction_days, rng=rng
+        )
+    
+    # Calculate prediction metrics
+    final_prices = predictions[:, -1]
+    price_change_pct = (final_prices - last_close) / last_close * 100
+    
+    for row, (idx, _) in enumerate(valid):
+        results[idx] = {
+            'predictions': predictions[row],
+            'upper_bound': upper_bounds[row],
+            'lower_bound': lower_bounds[row],
+            'current_price': round(float(last_close[row]), 2),
+            'predicted_price_30d': round(float(final_prices[row]), 2),
+            'price_change_pct': round(float(price_change_pct[row]), 2),
+            'prediction_direction': 'increase' if price_change_pct[row] > 0 else 'decrease'
         }
     
-    except Exception as e:
-        print(f"Error generating prediction for {ticker}: {e}")
-        return None
+    return results
+
+
+def predict_stock_trend(ticker, price_data, sentiment_score, rng=None, mode=None):
+    """Generate price predictions based on historical prices and sentiment"""
+    return predict_stock_trends([(ticker, price_data, sentiment_score)], rng=rng, mode=mode)[0]
 
 
 def generate_shocking_predictions(all_predictions, top_n=5):
@@ -0,0 +1,104 @@
+import threading
+import time
+from config import HOST_RATE_LIMITS
+import metrics
+
+
+class TokenBucket:
+    """Token bucket whose refill rate adapts to server feedback.
+    
+    Successful responses raise the rate additively up to its configured
+    ceiling; 429/5xx responses halve it (AIMD) and may pause the bucket for
+    the server's Retry-After period.
+    """
+    
+    def __init__(self, rate, burst, min_rate=None):
+        self.max_rate = float(rate)
+        self.min_rate = float(min_rate) if min_rate else self.max_rate / 16
+        self.rate = self.max_rate
+        self.burst = max(1, int(burst))
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+    
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def acquire(self):
+        """Block until a token is available and return the seconds spent waiting"""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                
+                wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            
+            time.sleep(wait)
+            waited += wait
+    
+    def on_success(self):
+        """Additive increase: recover a tenth of the ceiling per good response"""
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+    
+    def on_throttle(self, retry_after=None):
+        """Multiplicative decrease, optionally pausing for Retry-After seconds"""
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0.0
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(host):
+    """Return the shared bucket for a host key from HOST_RATE_LIMITS"""
+    with _buckets_lock:
+        if host not in _buckets:
+            rate, burst = HOST_RATE_LIMITS.get(host, HOST_RATE_LIMITS['default'])
+            _buckets[host] = TokenBucket(rate, burst)
+        return _buckets[host]
+
+
+def acquire(host):
+    """Wait for permission to send one request to host"""
+    waited = get_bucket(host).acquire()
+    metrics.incr('rate_limit.acquired', host=host)
+    if waited:
+        metrics.incr('rate_limit.wait_seconds', waited, host=host)
+    return waited
+
+
+def _parse_retry_after(value):
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def report(host, status_code, retry_after=None):
+    """Feed an HTTP status back into the host's rate"""
+    bucket = get_bucket(host)
+    if status_code == 429 or status_code >= 500:
+        metrics.incr('rate_limit.throttled', host=host)
+        bucket.on_throttle(_parse_retry_after(retry_after))
+    else:
+        bucket.on_success()
+
+
+def report_exception(host, error):
+    """Back off if a client library (e.g. yfinance) signalled throttling via an exception"""
+    message = str(error)
+    if type(error).__name__ == 'YFRateLimitError' or '429' in message or 'Too Many Requests' in message:
+        metrics.incr('rate_limit.throttled', host=host)
+        get_bucket(host).on_throttle()
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+from forecast_calendar import forecast_axis
+
+
+def _to_days(dates):
+    """Normalize dates (DatetimeIndex, strings, datetime64) to a datetime64[D] array"""
+    if isinstance(dates, np.ndarray) and dates.dtype == 'datetime64[D]':
+        return dates
+    index = pd.DatetimeIndex(dates)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    return index.values.astype('datetime64[D]')
+
+
+class PriceSeries:
+    """One ticker's dated float64 columns: price history or a forecast with its bounds.
+    
+    Holds a single datetime64[D] date array plus one numpy array per column,
+    instead of a list of {'date': str, 'price': float} dicts per column.
+    Dict rows are only built when serializing: to_rows() for the database
+    tables and to_records() for the JSON export. labels, if given, are the
+    dates' ISO strings precomputed (and shared, e.g. by ForecastCalendar).
+    """
+    
+    __slots__ = ('dates', 'labels', 'columns')
+    
+    def __init__(self, dates, labels=None, **columns):
+        self.dates = _to_days(dates)
+        self.labels = labels
+        self.columns = {name: np.asarray(values, dtype=np.float64) for name, values in columns.items()}
+        for name, values in self.columns.items():
+            if len(values) != len(self.dates):
+                raise ValueError(f"Column {name} has {len(values)} values for {len(self.dates)} dates")
+    
+    @classmethod
+    def empty(cls, *names):
+        """A series with no dates and the given (empty) columns"""
+        return cls([], **{name: [] for name in names})
+    
+    def __len__(self):
+        return len(self.dates)
+    
+    def __getitem__(self, name):
+        return self.columns[name]
+    
+    def __repr__(self):
+        if not len(self):
+            return f"PriceSeries(empty, columns={list(self.columns)})"
+        return f"PriceSeries({self.dates[0]}..{self.dates[-1]}, {len(self)} rows, columns={list(self.columns)})"
+    
+    def date_strings(self):
+        """Dates as 'YYYY-MM-DD' strings"""
+        if self.labels is not None:
+            return list(self.labels)
+        return np.datetime_as_string(self.dates, unit='D').tolist()
+    
+    def to_rows(self, ticker):
+        """Database rows: {'ticker', 'date', <column>: float, ...} per date"""
+        names = list(self.columns)
+        values = zip(*(self.columns[name].tolist() for name in names))
+        return [
+            {'ticker': ticker, 'date': date, **dict(zip(names, row))}
+            for date, row in zip(self.date_strings(), values)
+        ]
+    
+    def to_records(self, column='price'):
+        """The [{'date': str, 'price': float}] form of one column used by the JSON export"""
+        return [
+            {'date': date, 'price': price}
+            for date, price in zip(self.date_strings(), self.columns[column].tolist())
+        ]
+    
+    def to_dict(self):
+        """Compact JSON-serializable form (column-wise), see from_dict"""
+        return {'dates': self.date_strings(), **{name: values.tolist() for name, values in self.columns.items()}}
+    
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a series saved with to_dict()"""
+        data = dict(data)
+        return cls(data.pop('dates'), **data)
+
+
+def history_series(price_data):
+    """Closing-price history of a price frame as a PriceSeries"""
+    return PriceSeries(price_data.index, price=price_data['Close'].to_numpy())
+
+
+def forecast_series(price_data, prediction_result):
+    """Forecast and bounds on the days after the last historical bar"""
+    dates, labels = forecast_axis(price_data.index[-1], len(prediction_result['predictions']))
+    return PriceSeries(
+        dates,
+        labels=labels,
+        price=prediction_result['predictions'],
+        upper_bound=prediction_result['upper_bound'],
+        lower_bound=prediction_result['lower_bound']
+    )
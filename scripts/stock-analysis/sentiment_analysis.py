@@ -1,11 +1,16 @@
 import pandas as pd
+import numpy as np
 import nltk
-import time
+import hashlib
+import json
+import threading
 from nltk.sentiment.vader import SentimentIntensityAnalyzer
 from datetime import datetime, timedelta
 import os
 from config import FINANCE_LEXICON, DAYS_BACK
-from webscrape import scrape_finviz_news, scrape_yahoo_finance_news
+from webscrape import fetch_news
+from cache import HeadlineScoreCache, NewsStore, headline_hash
+import metrics
 
 # Setup NLTK
 nltk_data_dir = os.path.join(os.path.expanduser('~'), 'nltk_data')
@@ -14,17 +19,107 @@ nltk.data.path.append(nltk_data_dir)
 nltk.download('vader_lexicon', quiet=True, download_dir=nltk_data_dir)
 
 
+def parse_news_dates(dates, now=None):
+    """Parse a column of news dates in one vectorized pass.
+    
+    Handles Finviz 'Oct-16-26', 'MM/DD/YY', 'YYYY-MM-DD', 'Today' and
+    'Yesterday'. Each row is parsed on its own (scrapers fill in the date of
+    time-only rows); blank or unparseable entries fall back to now.
+    """
+    now = pd.Timestamp(now or datetime.now())
+    today = now.normalize()
+    
+    text = pd.Series(dates).astype('string').str.strip()
+    lower = text.str.lower()
+    
+    parsed = pd.to_datetime(text, format='%b-%d-%y', errors='coerce')
+    for fmt in ('%m/%d/%y', '%Y-%m-%d'):
+        missing = parsed.isna() & text.notna()
+        if not missing.any():
+            break
+        parsed[missing] = pd.to_datetime(text[missing], format=fmt, errors='coerce')
+    
+    parsed[lower == 'today'] = today
+    parsed[lower == 'yesterday'] = today - pd.Timedelta(days=1)
+    
+    return parsed.fillna(now)
+
+
 class SentimentAnalyzer:
-    def __init__(self):
+    def __init__(self, score_cache=None, news_store=None):
         self.sia = SentimentIntensityAnalyzer()
         # Add finance-specific terms to the lexicon
         self.sia.lexicon.update(FINANCE_LEXICON)
+        
+        # Scores are keyed by lexicon too, so editing FINANCE_LEXICON invalidates them
+        self.lexicon_key = hashlib.sha1(json.dumps(FINANCE_LEXICON, sort_keys=True).encode()).hexdigest()[:12]
+        self.score_cache = score_cache if score_cache is not None else HeadlineScoreCache()
+        self.memo = {}
+        self.memo_lock = threading.Lock()
+        
+        self.news_store = news_store if news_store is not None else NewsStore()
+        if self.news_store.needs_rescore(self.lexicon_key):
+            self._rescore_stored_news()
     
     def analyze_sentiment(self, text):
         """Analyze sentiment using VADER with finance-specific lexicon"""
         sentiment_scores = self.sia.polarity_scores(text)
         return sentiment_scores
     
+    def _headline_key(self, headline):
+        return hashlib.sha1(f"{self.lexicon_key}:{headline}".encode()).hexdigest()
+    
+    def score_headlines(self, headlines):
+        """Return VADER compound scores for headlines as a float64 array.
+        
+        Each distinct headline is scored at most once: repeats within the batch,
+        the run and earlier runs come from the in-memory and on-disk caches.
+        """
+        keys = [self._headline_key(headline) for headline in headlines]
+        unique = dict(zip(keys, headlines))
+        
+        with self.memo_lock:
+            scores = {key: self.memo[key] for key in unique if key in self.memo}
+        
+        missing = [key for key in unique if key not in scores]
+        if missing:
+            scores.update(self.score_cache.get_many(missing))
+        
+        with metrics.span('vader'):
+            new_scores = {
+                key: self.sia.polarity_scores(unique[key])['compound']
+                for key in missing if key not in scores
+            }
+        metrics.incr('cache.hits', len(unique) - len(new_scores), cache='headline')
+        metrics.incr('cache.misses', len(new_scores), cache='headline')
+        if new_scores:
+            self.score_cache.put_many(new_scores)
+            scores.update(new_scores)
+        
+        with self.memo_lock:
+            self.memo.update(scores)
+        
+        return np.fromiter((scores[key] for key in keys), dtype=np.float64, count=len(keys))
+    
+    def _rescore_stored_news(self):
+        """Rescore stored headlines after FINANCE_LEXICON changed"""
+        stored = self.news_store.all_headlines()
+        compounds = self.score_headlines([headline for _, _, headline in stored])
+        categories = self.categorize_scores(compounds)
+        self.news_store.rescore(self.lexicon_key, (
+            (ticker, key, compound, category)
+            for (ticker, key, _), compound, category in zip(stored, compounds, categories)
+        ))
+    
+    def categorize_scores(self, compound_scores):
+        """Vectorized categorize_sentiment for an array of compound scores"""
+        compound_scores = np.asarray(compound_scores, dtype=np.float64)
+        return np.select(
+            [compound_scores >= 0.05, compound_scores <= -0.05],
+            ['Bullish', 'Bearish'],
+            default='Neutral'
+        )
+    
     def categorize_sentiment(self, compound_score):
         """Categorize sentiment based on compound score"""
         if compound_score >= 0.05:
@@ -44,60 +139,39 @@ class SentimentAnalyzer:
         
         print(f"Analyzing sentiment for {ticker} ({name})...")
         
-        # Get news from multiple sources with retries
-        attempts = 0
-        max_attempts = 3
-        sources_data = []
+        # Get news from all sources concurrently (each scraper retries on its own)
+        news_df = fetch_news(ticker)
         
-        while attempts < max_attempts and not sources_data:
-            if attempts > 0:
-                print(f"Retrying news fetch for {ticker} (attempt {attempts+1}/{max_attempts})...")
-                time.sleep(5)
-            
-            # Try Finviz first
-            finviz_df = scrape_finviz_news(ticker)
-            if not finviz_df.empty:
-                sources_data.append(finviz_df)
-            
-            # Try Yahoo Finance
-            yahoo_df = scrape_yahoo_finance_news(ticker)
-            if not yahoo_df.empty:
-                sources_data.append(yahoo_df)
-            
-            attempts += 1
+        # Score and store only headlines not seen in earlier runs
+        if not news_df.empty:
+            news_df['parsed_date'] = parse_news_dates(news_df['date'])
+            news_df['hash'] = [headline_hash(headline) for headline in news_df['headline']]
+            news_df = news_df.drop_duplicates('hash')
+            new_df = news_df[~news_df['hash'].isin(self.news_store.known(ticker, news_df['hash']))].copy()
             
-            if sources_data:
-                break
-        
-        # Combine available news
-        news_df = pd.concat(sources_data, ignore_index=True) if sources_data else pd.DataFrame()
-        
-        if news_df.empty:
-            print(f"No news found for {ticker} after {attempts} attempts")
-            return self._default_neutral_sentiment(ticker, name)
-        
-        # Add sentiment analysis
-        news_df['sentiment'] = news_df['headline'].apply(self.analyze_sentiment)
-        news_df['compound'] = news_df['sentiment'].apply(lambda x: x['compound'])
-        news_df['category'] = news_df['compound'].apply(self.categorize_sentiment)
+            if not new_df.empty:
+                new_df['compound'] = self.score_headlines(new_df['headline'].tolist())
+                new_df['category'] = self.categorize_scores(new_df['compound'].to_numpy())
+                self.news_store.add(ticker, new_df)
         
-        # Filter by date
-        news_df['parsed_date'] = news_df.apply(self._parse_date, axis=1)
+        # Aggregate the stored headlines in the window
         cutoff_date = datetime.now() - timedelta(days=days_back)
-        filtered_df = news_df[news_df['parsed_date'] >= cutoff_date]
+        window = self.news_store.window(ticker, since=cutoff_date)
         
         # If no recent news, use all available
-        if filtered_df.empty and not news_df.empty:
-            filtered_df = news_df
+        if window['news_count'] == 0:
+            cutoff_date = None
+            window = self.news_store.window(ticker)
+        
+        if window['news_count'] == 0:
+            print(f"No news found for {ticker}")
+            return self._default_neutral_sentiment(ticker, name)
         
         # Calculate overall sentiment
-        avg_sentiment = filtered_df['compound'].mean()
+        avg_sentiment = window['compound_sum'] / window['news_count']
         sentiment_category = self.categorize_sentiment(avg_sentiment)
         sentiment_strength = abs(avg_sentiment)
         
-        # Count sentiment categories
-        sentiment_counts = filtered_df['category'].value_counts()
-        
         # Calculate investment score (0-100)
         normalized_sentiment = (avg_sentiment + 1) / 2
         investment_score = 50 + (normalized_sentiment - 0.5) * 100
@@ -110,53 +184,17 @@ class SentimentAnalyzer:
             'compound': round(avg_sentiment, 4),  # Add for compatibility
             'sentiment_category': sentiment_category,
             'category': sentiment_category,  # Add for compatibility
-            'bullish_count': int(sentiment_counts.get('Bullish', 0)),
-            'neutral_count': int(sentiment_counts.get('Neutral', 0)),
-            'bearish_count': int(sentiment_counts.get('Bearish', 0)),
-            'news_count': len(filtered_df),
+            'bullish_count': window['bullish_count'],
+            'neutral_count': window['neutral_count'],
+            'bearish_count': window['bearish_count'],
+            'news_count': window['news_count'],
             'sentiment_strength': round(sentiment_strength, 4),
             'investment_score': round(investment_score, 2),
-            'news_details': filtered_df
+            'news_details': self.news_store.headlines(ticker, since=cutoff_date)
         }
         
         return result    
 
-    def _parse_date(self, row):
-        """Parse date from news row"""
-        try:
-            date_str = row['date']
-            today = datetime.now()
-            
-            if not date_str or 'ago' in str(date_str).lower():
-                return today
-            
-            if isinstance(date_str, str):
-                if '/' in date_str:
-                    parts = date_str.split('/')
-                    if len(parts) == 3:
-                        month, day, year = parts
-                        if len(year) == 2:
-                            year = '20' + year
-                        return datetime(int(year), int(month), int(day))
-                elif '-' in date_str:
-                    try:
-                        return datetime.strptime(date_str, '%b-%d-%y')
-                    except:
-                        try:
-                            return datetime.strptime(date_str, '%Y-%m-%d')
-                        except:
-                            return today
-                elif date_str.lower() == 'today':
-                    return today
-                elif date_str.lower() == 'yesterday':
-                    return today - timedelta(days=1)
-            
-            return today
-        
-        except Exception as e:
-            print(f"Date parsing error: {e} for date: {row['date']}")
-            return datetime.now()
-    
     def _default_neutral_sentiment(self, ticker, name):
         """Return default neutral sentiment when no news is available"""
         return {
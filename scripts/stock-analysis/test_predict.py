@@ -0,0 +1,29 @@
+import os
+
+# config refuses to import without credentials; these tests never use them
+os.environ.setdefault('NEXT_PUBLIC_SUPABASE_URL', 'http://localhost:54321')
+os.environ.setdefault('NEXT_PUBLIC_SUPABASE_ANON_KEY', 'test')
+
+import numpy as np
+import pandas as pd
+
+from predict import make_rng, predict_stock_trends
+
+
+def _prices(index):
+    close = 100 * np.exp(np.cumsum(np.random.default_rng(0).normal(0, 0.01, len(index))))
+    return pd.DataFrame({'Close': close, 'Volume': 1.0}, index=index)
+
+
+def test_predict_stock_trends_mixed_timezones():
+    # yf.download and the price cache give tz-naive indexes, Ticker.history tz-aware ones
+    naive = pd.bdate_range(end='2026-10-16', periods=60)
+    aware = pd.bdate_range(end='2026-10-16', periods=60).tz_localize('America/New_York')
+    
+    results = predict_stock_trends(
+        [('NAIVE', _prices(naive), 0.1), ('AWARE', _prices(aware), 0.1)],
+        rng=make_rng(0)
+    )
+    
+    assert all(result is not None for result in results)
+    assert len(results[0]['predictions']) == len(results[1]['predictions'])
@@ -0,0 +1,33 @@
+from pandas.tseries.holiday import (
+    AbstractHolidayCalendar, Holiday, GoodFriday, USMartinLutherKingJr, USPresidentsDay,
+    USMemorialDay, USLaborDay, USThanksgivingDay, nearest_workday, sunday_to_monday
+)
+from pandas.tseries.offsets import CustomBusinessDay
+
+
+class NYSEHolidayCalendar(AbstractHolidayCalendar):
+    """Full-day NYSE market holidays, generated from rules (no network or data files).
+    
+    Saturday holidays are observed on the Friday before and Sunday holidays
+    on the Monday after, except New Year's Day, which the exchange does not
+    move back into the previous year. Early closes and one-off closures
+    (e.g. national days of mourning) are not included.
+    """
+    
+    rules = [
+        Holiday('New Years Day', month=1, day=1, observance=sunday_to_monday),
+        USMartinLutherKingJr,
+        USPresidentsDay,
+        GoodFriday,
+        USMemorialDay,
+        Holiday('Juneteenth', month=6, day=19, start_date='2022-01-01', observance=nearest_workday),
+        Holiday('Independence Day', month=7, day=4, observance=nearest_workday),
+        USLaborDay,
+        USThanksgivingDay,
+        Holiday('Christmas', month=12, day=25, observance=nearest_workday),
+    ]
+
+
+# One NYSE trading session; usable anywhere pandas takes a freq
+TRADING_DAY = CustomBusinessDay(calendar=NYSEHolidayCalendar())
+
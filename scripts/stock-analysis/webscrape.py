@@ -1,14 +1,20 @@
 import pandas as pd
 import yfinance as yf
-import requests
 from bs4 import BeautifulSoup
+import lxml.html
+import re
 import time
 import random
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime, timedelta
 from config import (
-    USER_AGENTS, FALLBACK_TICKERS, REQUEST_DELAY_MIN, 
-    REQUEST_DELAY_MAX, CHUNK_DELAY, CHUNK_SIZE
+    USER_AGENTS, FALLBACK_TICKERS, CHUNK_SIZE, PRICE_BATCH_SIZE,
+    PRICE_CACHE_ENABLED, UNIVERSE_MIN_STOCKS, NEWS_SOURCES, NEWS_SOURCE_TIMEOUTS
 )
+import rate_limit
+from http_session import fetch_text
+from cache import get_price_cache, load_universe_snapshot, save_universe_snapshot
+import metrics
 
 
 def get_random_user_agent():
@@ -16,10 +22,22 @@ def get_random_user_agent():
     return random.choice(USER_AGENTS)
 
 
-def get_top_101_stocks():
+def get_top_101_stocks(force_refresh=False):
     """Get a comprehensive list of top stocks by combining multiple sources"""
+    # Constituents and market caps barely move intraday; reuse the last build
+    if not force_refresh:
+        snapshot = load_universe_snapshot()
+        if snapshot is not None:
+            metrics.incr('cache.hits', cache='universe')
+            print(f"✓ Loaded {len(snapshot)} stocks from universe snapshot "
+                  f"(built {snapshot.attrs['built_at'].strftime('%Y-%m-%d %H:%M')})")
+            return snapshot.head(100)
+        metrics.incr('cache.misses', cache='universe')
+    
     try:
         all_tickers = set()
+        sp500_ok = False
+        used_fallback = False
         
         # Try S&P 500 components
         try:
@@ -32,11 +50,12 @@ def get_top_101_stocks():
                 'Connection': 'keep-alive',
             }
             sp500_url = "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
-            sp500_response = requests.get(sp500_url, headers=headers, timeout=15)
-            sp500_response.raise_for_status()
+            # Constituent lists rarely change, so revalidate with ETag/If-Modified-Since
+            sp500_html = fetch_text(sp500_url, 'wikipedia', headers=headers, revalidate=True)
             
             # Parse tables from Wikipedia - use StringIO to avoid FutureWarning
-            tables = pd.read_html(StringIO(sp500_response.text))
+            with metrics.span('parse', parser='wikipedia'):
+                tables = pd.read_html(StringIO(sp500_html))
             
             # The first table usually contains the S&P 500 companies
             sp500_df = tables[0]
@@ -51,6 +70,7 @@ def get_top_101_stocks():
             if ticker_column:
                 tickers = sp500_df[ticker_column].dropna().astype(str).str.strip().tolist()
                 all_tickers.update(tickers)
+                sp500_ok = True
                 print(f"✓ Fetched {len(tickers)} S&P 500 tickers")
             else:
                 # If no ticker column found, try to extract from first column
@@ -62,6 +82,7 @@ def get_top_101_stocks():
                     
                     if tickers:
                         all_tickers.update(tickers)
+                        sp500_ok = True
                         print(f"✓ Fetched {len(tickers)} S&P 500 tickers from first column")
                     else:
                         raise ValueError("Could not extract valid tickers from table")
@@ -77,10 +98,11 @@ def get_top_101_stocks():
             
             ndx_url = "https://en.wikipedia.org/wiki/Nasdaq-100"
             headers['User-Agent'] = get_random_user_agent()  # Rotate user agent
-            ndx_response = requests.get(ndx_url, headers=headers, timeout=15)
-            ndx_response.raise_for_status()
+            # Constituent lists rarely change, so revalidate with ETag/If-Modified-Since
+            ndx_html = fetch_text(ndx_url, 'wikipedia', headers=headers, revalidate=True)
             
-            ndx_tables = pd.read_html(StringIO(ndx_response.text))
+            with metrics.span('parse', parser='wikipedia'):
+                ndx_tables = pd.read_html(StringIO(ndx_html))
             
             # Find the table with ticker information
             ndx_df = None
@@ -103,10 +125,11 @@ def get_top_101_stocks():
             
             dow_url = "https://en.wikipedia.org/wiki/Dow_Jones_Industrial_Average"
             headers['User-Agent'] = get_random_user_agent()  # Rotate user agent
-            dow_response = requests.get(dow_url, headers=headers, timeout=15)
-            dow_response.raise_for_status()
+            # Constituent lists rarely change, so revalidate with ETag/If-Modified-Since
+            dow_html = fetch_text(dow_url, 'wikipedia', headers=headers, revalidate=True)
             
-            dow_tables = pd.read_html(StringIO(dow_response.text))
+            with metrics.span('parse', parser='wikipedia'):
+                dow_tables = pd.read_html(StringIO(dow_html))
             
             # Find the table with ticker information
             dow_df = None
@@ -127,6 +150,7 @@ def get_top_101_stocks():
         if len(all_tickers) < 50:
             print(f"Only {len(all_tickers)} tickers found, adding fallback tickers...")
             all_tickers.update(FALLBACK_TICKERS)
+            used_fallback = True
         
         # Clean tickers
         tickers = [t.strip().replace('.', '-') for t in all_tickers if t and isinstance(t, str) and len(t) <= 10]
@@ -142,8 +166,11 @@ def get_top_101_stocks():
             chunk_data = []
             for ticker in chunk:
                 try:
+                    # Rate limiting
+                    rate_limit.acquire('yfinance')
                     stock = yf.Ticker(ticker)
-                    info = stock.info
+                    with metrics.span('yfinance', call='info'):
+                        info = stock.info
                     market_cap = info.get('marketCap', 0)
                     name = info.get('shortName', info.get('longName', ticker))
                     sector = info.get('sector', 'Unknown')
@@ -156,18 +183,12 @@ def get_top_101_stocks():
                             'sector': sector
                         })
                 except Exception as e:
-                    # Silently skip failed tickers
-                    pass
-                
-                # Rate limiting
-                time.sleep(random.uniform(REQUEST_DELAY_MIN, REQUEST_DELAY_MAX))
+                    # Skip failed tickers, but slow down if yfinance is throttling us
+                    rate_limit.report_exception('yfinance', e)
             
             results.extend(chunk_data)
             success_count = len([r for r in chunk_data if r['market_cap'] > 0])
             print(f"Processed chunk {idx+1}/{len(ticker_chunks)} ({success_count} successful)")
-            
-            if idx < len(ticker_chunks) - 1:  # Don't sleep after last chunk
-                time.sleep(CHUNK_DELAY)
         
         # Convert to DataFrame and sort by market cap
         stocks_df = pd.DataFrame(results)
@@ -178,6 +199,15 @@ def get_top_101_stocks():
         if len(stocks_df) < 100:
             print(f"Warning: Only {len(stocks_df)} stocks available for analysis")
         
+        # Only pin a complete build; a degraded one is rebuilt next run
+        if not sp500_ok or used_fallback or len(stocks_df) < UNIVERSE_MIN_STOCKS:
+            print("Not saving universe snapshot (incomplete constituent or market cap data)")
+        else:
+            try:
+                save_universe_snapshot(stocks_df)
+            except Exception as e:
+                print(f"Warning: Could not save universe snapshot: {e}")
+        
         # Take top 100 by market cap
         top_stocks = stocks_df.head(100)
         return top_stocks
@@ -196,6 +226,7 @@ def _get_fallback_stocks():
     
     for ticker in FALLBACK_TICKERS[:50]:
         try:
+            rate_limit.acquire('yfinance')
             stock = yf.Ticker(ticker)
             info = stock.info
             market_cap = info.get('marketCap', 0)
@@ -210,20 +241,112 @@ def _get_fallback_stocks():
             })
         except Exception as e:
             print(f"Error in fallback list for {ticker}: {e}")
+            rate_limit.report_exception('yfinance', e)
             results.append({
                 'ticker': ticker,
                 'name': ticker,
                 'market_cap': 0,
                 'sector': 'Unknown'
             })
-        
-        time.sleep(random.uniform(REQUEST_DELAY_MIN, REQUEST_DELAY_MAX))
     
     df = pd.DataFrame(results)
     df = df[df['market_cap'] > 0]  # Filter out invalid entries
     return df.sort_values('market_cap', ascending=False).reset_index(drop=True)
 
 
+_TITLE_RE = re.compile(r'<title[^>]*>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+_NEWS_TABLE_RE = re.compile(r"""<table\b[^>]*\bid\s*=\s*["']?news-table\b""", re.IGNORECASE)
+_TABLE_TAG_RE = re.compile(r'<(/?)table\b', re.IGNORECASE)
+_SCRIPT_RE = re.compile(r'<(script|style)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+
+
+def _finviz_news_fragment(html):
+    """Return the raw markup of the news-table element, or None.
+    
+    Matches id="news-table" in either quote style and stops at the
+    matching </table>, so nested tables are kept whole.
+    """
+    match = _NEWS_TABLE_RE.search(html)
+    if match is None:
+        return None
+    
+    depth = 0
+    for tag in _TABLE_TAG_RE.finditer(html, match.start()):
+        depth += -1 if tag.group(1) else 1
+        if depth == 0:
+            end = html.find('>', tag.end())
+            return html[match.start():end + 1] if end != -1 else None
+    return None
+
+
+def _is_not_found_page(html):
+    """True for Finviz's error/unknown-ticker page (title or visible text, not scripts)"""
+    title = _TITLE_RE.search(html)
+    if title and "Error" in title.group(1):
+        return True
+    return "is not found" in _SCRIPT_RE.sub('', html)
+
+
+def parse_finviz_news_table(html):
+    """Extract Finviz headlines from a quote page.
+    
+    Only the news-table fragment is parsed (with lxml), not the whole page;
+    if it cannot be cut out, the whole page is parsed instead. Returns a
+    DataFrame with date/time/headline/source columns (empty for an unknown
+    ticker or error page), or None if the page has no news table.
+    """
+    fragment = _finviz_news_fragment(html)
+    if fragment is not None:
+        table = lxml.html.fromstring(fragment)
+    else:
+        if _is_not_found_page(html):
+            return pd.DataFrame()
+        if not html.strip():
+            return None
+        tables = lxml.html.fromstring(html).xpath('//*[@id="news-table"]')
+        if not tables:
+            return None
+        table = tables[0]
+    
+    dates, times, headlines, sources = [], [], [], []
+    current_date = ''
+    
+    for row in table.iter('tr'):
+        cell = next(row.iter('td'), None)
+        if cell is None:
+            continue
+        
+        # Finviz prints the date only on each day's first headline. Track it
+        # before filtering rows, so a dropped dated row still sets the day
+        # for the time-only rows after it
+        date_cell = cell.text_content().split()
+        time_str = ''
+        
+        if len(date_cell) >= 1:
+            if ':' in date_cell[0]:
+                time_str = date_cell[0]
+            elif len(date_cell) >= 2:
+                current_date = date_cell[0]
+                time_str = date_cell[1] if ':' in date_cell[1] else ''
+        
+        link = next(row.iter('a'), None)
+        headline = link.text_content().strip() if link is not None else None
+        if not headline or len(headline) <= 5:
+            continue
+        
+        span = next(row.iter('span'), None)
+        
+        dates.append(current_date)
+        times.append(time_str)
+        headlines.append(headline)
+        sources.append(span.text_content().strip() if span is not None else "Unknown")
+    
+    if not headlines:
+        return pd.DataFrame()
+    
+    return pd.DataFrame({'date': dates, 'time': times, 'headline': headlines, 'source': sources})
+
+
 def scrape_finviz_news(ticker):
     """Scrape news headlines for a specific ticker from Finviz"""
     url = f'https://finviz.com/quote.ashx?t={ticker}'
@@ -238,59 +361,21 @@ def scrape_finviz_news(ticker):
     }
     
     max_retries = 3
-    retry_delay = 5
     
+    # Retries are paced by the finviz rate limiter, which backs off after a 429
     for attempt in range(max_retries):
         try:
-            if attempt > 0:
-                time.sleep(retry_delay)
-            
-            time.sleep(random.uniform(REQUEST_DELAY_MIN, REQUEST_DELAY_MAX))
-            
-            response = requests.get(url, headers=headers, timeout=15)
-            response.raise_for_status()
-            
-            soup = BeautifulSoup(response.text, 'html.parser')
+            html = fetch_text(url, 'finviz', headers=headers)
             
-            # Check if we got a valid page
-            if "is not found" in soup.text or "Error" in soup.title.text:
-                return pd.DataFrame()
+            with metrics.span('parse', parser='finviz'):
+                news_df = parse_finviz_news_table(html)
             
-            news_table = soup.find(id='news-table')
-            if not news_table:
+            # No news table (e.g. a partial page) - try again
+            if news_df is None:
                 continue
             
-            news_data = []
-            current_date = datetime.now().strftime('%m/%d/%y')
-            
-            for row in news_table.find_all('tr'):
-                if not row.td:
-                    continue
-                
-                try:
-                    date_cell = row.td.text.strip().split() if row.td and row.td.text else []
-                    
-                    date_str = current_date
-                    time_str = ''
-                    
-                    if len(date_cell) >= 1:
-                        if ':' in date_cell[0]:
-                            time_str = date_cell[0]
-                        elif len(date_cell) >= 2:
-                            date_str = date_cell[0]
-                            time_str = date_cell[1] if ':' in date_cell[1] else ''
-                    
-                    headline = row.a.text.strip() if row.a else None
-                    source = row.span.text.strip() if row.span else "Unknown"
-                    
-                    if headline and len(headline) > 5:
-                        news_data.append([date_str, time_str, headline, source])
-                
-                except Exception:
-                    continue
-            
-            if news_data:
-                return pd.DataFrame(news_data, columns=['date', 'time', 'headline', 'source'])
+            if not news_df.empty:
+                return news_df
             
         except Exception as e:
             if attempt == max_retries - 1:
@@ -304,13 +389,13 @@ def scrape_yahoo_finance_news(ticker):
     news_data = []
     
     try:
-        time.sleep(random.uniform(REQUEST_DELAY_MIN, REQUEST_DELAY_MAX))
-        
         # Use yfinance news (more reliable)
         try:
             import yfinance as yf
+            rate_limit.acquire('yfinance')
             stock = yf.Ticker(ticker)
-            news = stock.news
+            with metrics.span('yfinance', call='news'):
+                news = stock.news
             
             if news:
                 for item in news[:20]:
@@ -325,8 +410,8 @@ def scrape_yahoo_finance_news(ticker):
                 
                 if news_data:
                     return pd.DataFrame(news_data, columns=['date', 'time', 'headline', 'source'])
-        except Exception:
-            pass
+        except Exception as e:
+            rate_limit.report_exception('yfinance', e)
         
         # Fallback: try scraping main quote page
         base_url = f'https://finance.yahoo.com/quote/{ticker}'
@@ -338,10 +423,10 @@ def scrape_yahoo_finance_news(ticker):
         }
         
         try:
-            response = requests.get(base_url, headers=headers, timeout=15)
-            response.raise_for_status()
+            html = fetch_text(base_url, 'yahoo', headers=headers)
             
-            soup = BeautifulSoup(response.text, 'html.parser')
+            with metrics.span('parse', parser='yahoo'):
+                soup = BeautifulSoup(html, 'html.parser')
             
             news_items = (
                 soup.select('h3') +
@@ -377,16 +462,84 @@ def scrape_yahoo_finance_news(ticker):
     return pd.DataFrame(news_data, columns=['date', 'time', 'headline', 'source']) if news_data else pd.DataFrame()
 
 
+NEWS_SCRAPERS = {
+    'finviz': scrape_finviz_news,
+    'yahoo': scrape_yahoo_finance_news,
+}
+
+
+def fetch_news(ticker, sources=None, timeouts=None):
+    """Query all news sources for a ticker at once and merge what arrives in time.
+    
+    Each source runs in its own thread and gets its own deadline (seconds,
+    from NEWS_SOURCE_TIMEOUTS by default), so the wait is bounded by the
+    slowest source rather than the sum of all of them. A source that
+    misses its deadline is left to finish in the background and ignored.
+    
+    Returns a DataFrame of date/time/headline/source rows in source order
+    (empty if no source returned headlines).
+    """
+    if sources is None:
+        sources = NEWS_SOURCES
+    if timeouts is None:
+        timeouts = NEWS_SOURCE_TIMEOUTS
+    
+    def run(source):
+        with metrics.span('ticker.news', ticker=ticker, source=source):
+            return NEWS_SCRAPERS[source](ticker)
+    
+    executor = ThreadPoolExecutor(max_workers=max(1, len(sources)), thread_name_prefix=f'news-{ticker}')
+    started = time.monotonic()
+    futures = {source: executor.submit(run, source) for source in sources}
+    # Don't block on stragglers; their threads exit once the request returns
+    executor.shutdown(wait=False)
+    
+    frames = []
+    for source, future in futures.items():
+        remaining = timeouts.get(source, 15) - (time.monotonic() - started)
+        try:
+            news_df = future.result(timeout=max(0, remaining))
+        except FutureTimeoutError:
+            print(f"    ⚠ {source} news for {ticker} timed out")
+            metrics.incr('news.timeouts', source=source)
+            continue
+        except Exception as e:
+            print(f"    ⚠ {source} news for {ticker} failed: {e}")
+            continue
+        
+        if not news_df.empty:
+            frames.append(news_df)
+    
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
 def get_stock_price_data(ticker, days=90):
     """Get historical stock price data using yfinance (default: 90 days = 3 months)"""
     try:
         end_date = datetime.now()
         start_date = end_date - timedelta(days=days)
         
+        # Only download bars newer than the cached ones (or nothing if fresh)
+        cache = get_price_cache() if PRICE_CACHE_ENABLED else None
+        fetch_from = cache.fetch_start(ticker, start_date, end_date) if cache else start_date
+        
+        if fetch_from is None:
+            metrics.incr('cache.hits', cache='price')
+            return cache.load(ticker, start_date)
+        if cache is not None:
+            metrics.incr('cache.misses', cache='price')
+        
         stock = yf.Ticker(ticker)
         
         # Try to fetch historical data
-        hist = stock.history(start=start_date, end=end_date)
+        rate_limit.acquire('yfinance')
+        with metrics.span('yfinance', call='history'):
+            hist = stock.history(start=fetch_from, end=end_date)
+        
+        if cache is not None:
+            cache.merge(ticker, hist, full=fetch_from == start_date, now=end_date)
+            cache.save()
+            hist = cache.load(ticker, start_date)
         
         if hist is None:
             print(f"    ⚠ yfinance returned None for {ticker}")
@@ -416,10 +569,122 @@ def get_stock_price_data(ticker, days=90):
         return hist
     
     except Exception as e:
+        rate_limit.report_exception('yfinance', e)
         print(f"    ✗ Error fetching price data for {ticker}: {type(e).__name__}: {str(e)}")
         return None
 
 
+def _download_price_batches(tickers, start_date, end_date, batch_size):
+    """Download tickers in batched yf.download calls and return one wide frame"""
+    frames = []
+    batches = [tickers[i:i + batch_size] for i in range(0, len(tickers), batch_size)]
+    
+    for idx, batch in enumerate(batches):
+        try:
+            rate_limit.acquire('yfinance')
+            with metrics.span('yfinance', call='download'):
+                data = yf.download(
+                    batch,
+                    start=start_date,
+                    end=end_date,
+                    group_by='ticker',
+                    auto_adjust=True,
+                    threads=True,
+                    progress=False,
+                    multi_level_index=True
+                )
+            metrics.incr('yfinance.tickers_requested', len(batch))
+            
+            if data is None or data.empty:
+                print(f"    ⚠ No price data returned for batch {idx+1}/{len(batches)}")
+                continue
+            
+            frames.append(data)
+            print(f"✓ Downloaded price batch {idx+1}/{len(batches)} ({len(batch)} tickers)")
+        
+        except Exception as e:
+            rate_limit.report_exception('yfinance', e)
+            print(f"    ✗ Error downloading price batch {idx+1}/{len(batches)}: {type(e).__name__}: {str(e)}")
+    
+    return pd.concat(frames, axis=1) if frames else pd.DataFrame()
+
+
+def get_bulk_price_data(tickers, days=90, batch_size=None, use_cache=None):
+    """Download price history for many tickers in a few batched requests.
+
+    Returns one wide DataFrame with (ticker, field) columns; use
+    slice_price_data() to get a single ticker's history from it. With the
+    price cache enabled only bars newer than the cached ones are downloaded.
+    """
+    if batch_size is None:
+        batch_size = PRICE_BATCH_SIZE
+    if use_cache is None:
+        use_cache = PRICE_CACHE_ENABLED
+    
+    tickers = list(dict.fromkeys(tickers))
+    if not tickers:
+        return pd.DataFrame()
+    
+    end_date = datetime.now()
+    start_date = end_date - timedelta(days=days)
+    
+    if not use_cache:
+        return _download_price_batches(tickers, start_date, end_date, batch_size)
+    
+    cache = get_price_cache()
+    
+    # Group tickers by where their download starts; usually one delta group
+    plans = {}
+    for ticker in tickers:
+        fetch_from = cache.fetch_start(ticker, start_date, end_date)
+        if fetch_from is not None:
+            plans.setdefault(fetch_from, []).append(ticker)
+    
+    refresh_count = sum(len(group) for group in plans.values())
+    metrics.incr('cache.hits', len(tickers) - refresh_count, cache='price')
+    metrics.incr('cache.misses', refresh_count, cache='price')
+    print(f"Price cache: {len(tickers) - refresh_count} fresh, {refresh_count} to refresh")
+    
+    for fetch_from, group in plans.items():
+        downloaded = _download_price_batches(group, fetch_from, end_date, batch_size)
+        for ticker in group:
+            cache.merge(ticker, slice_price_data(downloaded, ticker), full=fetch_from == start_date, now=end_date)
+    
+    histories = {}
+    for ticker in tickers:
+        hist = cache.load(ticker, start_date)
+        if hist is not None:
+            histories[ticker] = hist
+    
+    cache.evict(end_date)
+    cache.save()
+    
+    return pd.concat(histories, axis=1) if histories else pd.DataFrame()
+
+
+def slice_price_data(bulk_prices, ticker):
+    """Return one ticker's history from a get_bulk_price_data() frame, or None"""
+    if bulk_prices is None or bulk_prices.empty:
+        return None
+    
+    if ticker not in bulk_prices.columns.get_level_values(0):
+        return None
+    
+    hist = bulk_prices[ticker]
+    
+    if 'Close' not in hist.columns:
+        return None
+    
+    # Rows only need filtering when this ticker is missing bars the others have
+    missing = hist['Close'].isna()
+    if missing.all():
+        return None
+    if missing.any():
+        hist = hist[~missing]
+    
+    return hist
+
+
 if __name__ == "__main__":
     # Test the functions
     print("Testing webscrape functions...")